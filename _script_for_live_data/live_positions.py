@@ -0,0 +1,207 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from pyproj import Geod
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, json parses the same files more slowly
+    orjson = None
+
+GEOD = Geod(ellps='WGS84')  # Distances between positions are measured on it, in meters, the same in every city
+MAX_SPEED = 100  # Speeds above this (km/h) are GPS jumps, not driving
+MAX_GAP = 300  # Seconds between two positions of a trip beyond which no speed is measured
+FLUSH_ROWS = 500_000  # Measured positions held in memory before they are written to the store
+
+# Files of the store next to its date=YYYY-MM-DD partitions; the leading underscore hides them
+# from parquet readers
+STATE_FILE = "_ingest_state.arrow"
+INGESTED_FILE = "_ingested_files.txt"
+
+POSITION_COLUMNS = ['trip_id', 'timestamp', 'lat', 'lon']
+
+
+def read_position_file(path):
+    """The positions of one JSON dump ({'positions': [...]} or a bare list) as records."""
+    with open(path, 'rb') as f:
+        data = orjson.loads(f.read()) if orjson is not None else json.load(f)
+    return data['positions'] if isinstance(data, dict) else data
+
+
+def positions_frame(records):
+    """
+    Positions as a DataFrame: trip_id, timestamp (int64 milliseconds, UTC), lat and lon.
+    Rows missing any of them, or with a timestamp that does not parse, are dropped.
+    """
+    df = pd.DataFrame.from_records(records, columns=POSITION_COLUMNS)
+    timestamp = pd.to_datetime(df['timestamp'], utc=True, errors='coerce')
+    lat = pd.to_numeric(df['lat'], errors='coerce')
+    lon = pd.to_numeric(df['lon'], errors='coerce')
+    valid = (df['trip_id'].notna() & timestamp.notna() & lat.notna() & lon.notna()).to_numpy()
+    return pd.DataFrame({
+        'trip_id': df['trip_id'].astype(str).to_numpy()[valid],
+        'timestamp': timestamp[valid].dt.as_unit('ms').astype(np.int64).to_numpy(),
+        'lat': lat.to_numpy(dtype=np.float64)[valid],
+        'lon': lon.to_numpy(dtype=np.float64)[valid],
+    })
+
+
+def empty_state():
+    """
+    Last accepted position of every running trip, as compact arrays: trip_ids (a pandas Index to
+    look them up), lat, lon and timestamp (milliseconds).
+    """
+    return {'trip_id': pd.Index([], dtype=object), 'lat': np.empty(0), 'lon': np.empty(0),
+            'timestamp': np.empty(0, dtype=np.int64)}
+
+
+def _step_speeds(trips, lat, lon, timestamp):
+    """Distance (m), time (s) and speed (km/h) from the previous row of the same trip, NaN for a trip's first row."""
+    same_trip = np.concatenate([[False], trips[1:] == trips[:-1]])
+    dist = np.concatenate([[np.nan], GEOD.inv(lon[:-1], lat[:-1], lon[1:], lat[1:])[2]])
+    dt = np.concatenate([[np.nan], np.diff(timestamp) / 1000])
+    dist[~same_trip], dt[~same_trip] = np.nan, np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = dist / dt * 3.6
+    return dist, dt, speed
+
+
+def measure_positions(positions, state, max_speed=MAX_SPEED, max_gap=MAX_GAP):
+    """
+    Speeds between consecutive positions of every trip (distances on the ellipsoid, see GEOD),
+    continuing from the state of the earlier ones (see empty_state).
+    Outliers are rejected before measuring: repeated timestamps of a trip, and single positions
+    jumping away and back (too fast to reach and to leave). Speeds over max_speed left after
+    that, or over gaps longer than max_gap seconds, are NaN; those positions still start the next
+    stretch. A jump in the last position of a trip in the batch cannot be told from a real move
+    until the next batch, so it is kept, with NaN speeds to and from it. Returns the positions
+    with dist (m), dt (s) and speed (km/h), ordered by trip and time, and the updated state
+    without trips silent for longer than max_gap.
+    """
+    # The state of the batch's trips goes first, ties in time keep the state's position
+    known = state['trip_id'].get_indexer(pd.unique(positions['trip_id']))
+    known = known[known >= 0]
+    previous = pd.DataFrame({'trip_id': state['trip_id'][known].to_numpy(dtype=object), 'lat': state['lat'][known],
+                             'lon': state['lon'][known], 'timestamp': state['timestamp'][known], '_new': False})
+    rows = pd.concat([previous, positions.assign(_new=True)], ignore_index=True)
+    rows = rows.sort_values(['trip_id', 'timestamp', '_new'], kind='stable')
+    rows = rows.drop_duplicates(['trip_id', 'timestamp']).reset_index(drop=True)
+    if rows.empty:
+        # An empty dump (a poll without any vehicle) measures nothing and leaves the state as it was
+        return pd.DataFrame({column: [] for column in POSITION_COLUMNS + ['dist', 'dt', 'speed']}), state
+
+    trips = pd.factorize(rows['trip_id'])[0]
+    lat, lon, timestamp = rows['lat'].to_numpy(), rows['lon'].to_numpy(), rows['timestamp'].to_numpy()
+    _, _, speed = _step_speeds(trips, lat, lon, timestamp)
+    leaving = np.concatenate([speed[1:], [np.nan]])
+    spikes = (speed > max_speed) & (leaving > max_speed) & rows['_new'].to_numpy()
+    if spikes.any():
+        rows, trips = rows[~spikes].reset_index(drop=True), trips[~spikes]
+        lat, lon, timestamp = lat[~spikes], lon[~spikes], timestamp[~spikes]
+
+    dist, dt, speed = _step_speeds(trips, lat, lon, timestamp)
+    speed[~((dt > 0) & (dt <= max_gap) & (speed <= max_speed))] = np.nan
+    rows = rows.assign(dist=dist, dt=dt, speed=speed)
+
+    # Last position of every trip, merged into the state
+    last = np.concatenate([trips[1:] != trips[:-1], [True]]) if len(trips) else np.zeros(0, dtype=bool)
+    state = update_state(state, rows[last], max_gap)
+    measured = rows[rows['_new']].reset_index(drop=True)
+    return measured[POSITION_COLUMNS + ['dist', 'dt', 'speed']], state
+
+
+def update_state(state, last, max_gap=MAX_GAP):
+    """The state with the last positions of trips replaced or added, and trips older than max_gap dropped."""
+    kept = ~state['trip_id'].isin(last['trip_id'])
+    trip_ids = np.concatenate([state['trip_id'][kept].to_numpy(dtype=object), last['trip_id'].to_numpy(dtype=object)])
+    lat = np.concatenate([state['lat'][kept], last['lat'].to_numpy()])
+    lon = np.concatenate([state['lon'][kept], last['lon'].to_numpy()])
+    timestamp = np.concatenate([state['timestamp'][kept], last['timestamp'].to_numpy()])
+    if len(timestamp):
+        recent = timestamp >= timestamp.max() - max_gap * 1000
+        trip_ids, lat, lon, timestamp = trip_ids[recent], lat[recent], lon[recent], timestamp[recent]
+    return {'trip_id': pd.Index(trip_ids, dtype=object), 'lat': lat, 'lon': lon, 'timestamp': timestamp}
+
+
+def load_state(store_dir):
+    """The state and the names of the dump files already in the store, empty for a new store."""
+    state, ingested = empty_state(), set()
+    state_path = os.path.join(store_dir, STATE_FILE)
+    if os.path.exists(state_path):
+        df = feather.read_feather(state_path)
+        state = {'trip_id': pd.Index(df['trip_id'].to_numpy(dtype=object), dtype=object), 'lat': df['lat'].to_numpy(),
+                 'lon': df['lon'].to_numpy(), 'timestamp': df['timestamp'].to_numpy()}
+    ingested_path = os.path.join(store_dir, INGESTED_FILE)
+    if os.path.exists(ingested_path):
+        with open(ingested_path) as f:
+            ingested = set(f.read().splitlines())
+    return state, ingested
+
+
+def save_state(store_dir, state, files):
+    """Saves the state and appends the dump files whose positions were written to the store."""
+    df = pd.DataFrame({'trip_id': state['trip_id'].to_numpy(dtype=object), 'lat': state['lat'], 'lon': state['lon'],
+                       'timestamp': state['timestamp']})
+    feather.write_feather(df.astype({'trip_id': str}), os.path.join(store_dir, STATE_FILE))
+    with open(os.path.join(store_dir, INGESTED_FILE), 'a') as f:
+        f.writelines(f"{name}\n" for name in files)
+
+
+def _next_part(store_dir):
+    parts = [name for _, _, names in os.walk(store_dir) for name in names if name.startswith('part-')]
+    return max((int(name[5:10]) for name in parts), default=-1) + 1
+
+
+def append_to_store(measured, store_dir):
+    """
+    Appends measured positions to the store: one parquet file per UTC date partition
+    (date=YYYY-MM-DD), numbered after the files already there. Returns the rows written.
+    """
+    if measured.empty:
+        return 0
+    part = _next_part(store_dir)
+    measured = measured.assign(timestamp=pd.to_datetime(measured['timestamp'], unit='ms', utc=True))
+    for date, rows in measured.groupby(measured['timestamp'].dt.strftime('%Y-%m-%d'), sort=True):
+        partition_dir = os.path.join(store_dir, f"date={date}")
+        os.makedirs(partition_dir, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), os.path.join(partition_dir, f"part-{part:05d}.parquet"))
+    return len(measured)
+
+
+def read_store(store_dir, columns=None, filters=None):
+    """The measured positions of the store (or its columns, rows matching pyarrow filters, e.g. on 'date')."""
+    return pd.read_parquet(store_dir, columns=columns, filters=filters)
+
+
+def ingest_positions(json_dir, store_dir, max_speed=MAX_SPEED, max_gap=MAX_GAP, flush_rows=FLUSH_ROWS):
+    """
+    Streams the JSON position dumps of json_dir (in name order, those not in the store yet) into
+    the store: every dump is parsed on its own and measured against the state of the trips,
+    results are written every flush_rows positions, then the state is saved, so memory holds
+    one dump and one flush whatever the number of dumps, and a later run continues where this
+    one stopped. Returns the number of positions written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    state, ingested = load_state(store_dir)
+    names = sorted(name for name in os.listdir(json_dir) if name.endswith(".json") and name not in ingested)
+    print(f"{len(names)} new position files in {json_dir}")
+
+    pending, pending_files, pending_rows, written = [], [], 0, 0
+    for number, name in enumerate(names, 1):
+        positions = positions_frame(read_position_file(os.path.join(json_dir, name)))
+        measured, state = measure_positions(positions, state, max_speed, max_gap)
+        pending.append(measured)
+        pending_files.append(name)
+        pending_rows += len(measured)
+
+        if pending_rows >= flush_rows or number == len(names):
+            written += append_to_store(pd.concat(pending, ignore_index=True), store_dir)
+            save_state(store_dir, state, pending_files)
+            print(f"Ingested {number} of {len(names)} files, {written} positions written")
+            pending, pending_files, pending_rows = [], [], 0
+    return written
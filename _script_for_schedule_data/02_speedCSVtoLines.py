@@ -1,72 +1,15 @@
-import geopandas as gpd
-import pandas as pd
-from shapely.geometry import LineString
-import numpy as np
-import math
+from city_profiles import city_profile
+from pipeline import load_shapes_processed, stage_02_segments, save_segments
 
-# Set the folder path for ease of access
-folder_path = r"C:\Users\Asus\OneDrive\Pulpit\Rozne\QGIS\TransitLineSpeeds\_schedule_data\Warszawa_2024_11_10\\"
-
-def calculate_direction(line):
-    """Calculate the azimuth of the line segment (in degrees)."""
-    if isinstance(line, LineString) and len(line.coords) > 1:
-        start, end = line.coords[0], line.coords[-1]
-        angle = np.degrees(np.arctan2(end[1] - start[1], end[0] - start[0]))
-        return angle % 360  # Normalize angle to be within [0, 360] degrees
-    return None
-
-def offset_segment_right(segment, distance=10):
-    """Offset a line segment to the right by a given distance."""
-    if isinstance(segment, LineString):
-        start, end = segment.coords[:2]
-        azimuth = np.arctan2(end[1] - start[1], end[0] - start[0])
-        perp_azimuth = azimuth - np.pi / 2
-        start_offset = (start[0] + distance * np.cos(perp_azimuth), start[1] + distance * np.sin(perp_azimuth))
-        end_offset = (end[0] + distance * np.cos(perp_azimuth), end[1] + distance * np.sin(perp_azimuth))
-        return LineString([start_offset, end_offset])
-    return segment
+CITY = 'Warszawa'  # Any city of city_profiles.CITY_PROFILES
 
 def process_data():
-    # Load the processed shapes CSV
-    shapes_csv_path = folder_path + "shapes_processed.csv"
-    shapes_df = pd.read_csv(shapes_csv_path)
-    gdf = gpd.GeoDataFrame(
-        shapes_df,
-        geometry=gpd.points_from_xy(shapes_df.shape_pt_lon, shapes_df.shape_pt_lat),
-        crs="EPSG:4326"
-    ).to_crs(epsg=2180)  # Direct conversion to EPSG:2180 for metric calculation
-
-    # Sort and create line segments
-    gdf = gdf.sort_values(['shape_id', 'shape_pt_sequence'])
-    segments = []
-
-    for shape_id, group in gdf.groupby('shape_id'):
-        prev_point = None
-        for idx, row in group.iterrows():
-            if prev_point is not None:
-                segment = LineString([prev_point, row['geometry']])
-                segments.append({
-                    'shape_id': shape_id,
-                    'vehicle': row['vehicle'],
-                    'geometry': segment,
-                    'speed': row['speed'],
-                    'length': segment.length,
-                    'direction': calculate_direction(segment)
-                })
-            prev_point = row['geometry']
-
-    # Create a GeoDataFrame from the segments
-    segment_gdf = gpd.GeoDataFrame(segments, crs="EPSG:2180")
-    segment_gdf['geometry'] = segment_gdf['geometry'].apply(offset_segment_right)
-
-    # Set the geometry column explicitly
-    segment_gdf = segment_gdf.set_geometry('geometry')
-    segment_gdf['length'] = segment_gdf['geometry'].length
-    segment_gdf['direction'] = segment_gdf['geometry'].apply(calculate_direction)
+    # Load the processed shapes CSV and create line segments in the city's metric CRS
+    profile = city_profile(CITY)
+    segment_gdf = stage_02_segments(load_shapes_processed(profile), profile, kind='speeds')
 
-    # Save to a shapefile
-    output_path = folder_path + "speed_processed_to_lines.shp"
-    segment_gdf.to_file(output_path, driver='ESRI Shapefile')
+    # Save the segments layer (in the profile's output_format)
+    save_segments(segment_gdf, profile, kind='speeds')
 
 if __name__ == "__main__":
-    process_data()
\ No newline at end of file
+    process_data()
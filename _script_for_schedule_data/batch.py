@@ -0,0 +1,142 @@
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import pandas as pd
+
+from city_profiles import city_profile, CITY_PROFILES
+from gtfs_feed import feed_table_size
+from pipeline import KINDS, run_city
+
+MEMORY_FACTOR = 8  # Peak memory of a city's run per byte of its uncompressed stop_times.txt
+MIN_JOB_MEMORY = 512 * 2**20  # Memory reserved for any city, however small its feed
+MEMORY_HEADROOM = 0.8  # Share of the available memory the batch may plan to use
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def available_memory():
+    """Bytes of memory available to new processes (psutil, or sysconf on Linux); None if unknown."""
+    if psutil is not None:
+        return psutil.virtual_memory().available
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def estimate_memory(folder_path):
+    """Expected peak memory of one city's run, scaled from the size of its stop_times."""
+    try:
+        size = feed_table_size(folder_path, "stop_times.txt")
+    except FileNotFoundError:
+        return MIN_JOB_MEMORY
+    return max(MIN_JOB_MEMORY, size * MEMORY_FACTOR)
+
+
+def run_job(city, kinds, folder_path):
+    """Runs the pipeline kinds of one city in order, one summary row per kind (with the error if it failed)."""
+    rows = []
+    for kind in kinds:
+        started = time.perf_counter()
+        try:
+            row = run_city(city, kind, folder_path=folder_path)
+            row['status'] = 'ok'
+        except Exception:
+            row = {'city': city, 'kind': kind, 'status': 'failed', 'error': traceback.format_exc(limit=3)}
+        row['total_s'] = time.perf_counter() - started
+        rows.append(row)
+    return rows
+
+
+def run_batch(jobs, kinds=('speeds',), workers=None, memory_budget=None):
+    """
+    Runs the pipeline for every (city, folder_path) job in a pool of worker processes.
+    Besides the worker count, jobs are only started while their estimated memory fits in
+    memory_budget (by default a share of the available memory); the largest feeds start first,
+    and a feed larger than the whole budget runs on its own. The kinds of one city run in the
+    same worker, one after the other, as they share the city's stop_times cache.
+    Returns the summary rows of all cities and kinds.
+    """
+    workers = workers or os.cpu_count() or 1
+    if memory_budget is None:
+        available = available_memory()
+        memory_budget = available * MEMORY_HEADROOM if available else float('inf')
+
+    pending = sorted(((estimate_memory(folder_path), city, folder_path) for city, folder_path in jobs), reverse=True)
+    print(f"Running {len(pending)} cities on up to {workers} workers, "
+          f"memory budget {memory_budget / 2**30:.1f} GB")
+
+    rows = []
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # Start every pending job that fits next to the running ones
+            in_use = sum(memory for memory, _ in running.values())
+            for job in list(pending):
+                memory, city, folder_path = job
+                if len(running) >= workers:
+                    break
+                if running and in_use + memory > memory_budget:
+                    continue
+                future = executor.submit(run_job, city, kinds, folder_path)
+                running[future] = (memory, city)
+                in_use += memory
+                pending.remove(job)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                _, city = running.pop(future)
+                city_rows = future.result()
+                rows.extend(city_rows)
+                print(f"Finished {city}: " + ", ".join(f"{row['kind']} {row['status']}" for row in city_rows))
+    return rows
+
+
+def print_summary(rows):
+    """Per city and kind: status, stage timings and row counts."""
+    summary = pd.DataFrame(rows)
+    for column in summary.columns[summary.columns.str.endswith('_rows')]:
+        summary[column] = summary[column].astype('Int64')  # Failed runs have no counts
+    columns = [column for column in ['city', 'kind', 'status', 'total_s',
+                                     'stage_01_s', 'stage_01_rows', 'stage_02_s', 'stage_02_rows',
+                                     'stage_03_s', 'stage_03_rows'] if column in summary]
+    with pd.option_context('display.max_columns', None, 'display.width', None, 'display.float_format', '{:.1f}'.format):
+        print(summary[columns].sort_values(['city', 'kind']).to_string(index=False))
+    for row in rows:
+        if row['status'] == 'failed':
+            print(f"\n{row['city']} {row['kind']} failed:\n{row['error']}")
+    return summary
+
+
+def parse_job(entry):
+    """A job given as CITY or CITY=FOLDER (a feed folder other than the profile's)."""
+    city, _, folder_path = entry.partition('=')
+    return city, folder_path or city_profile(city)['folder_path']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the schedule data pipeline for several cities in parallel.")
+    parser.add_argument('feeds', nargs='*', help="CITY or CITY=FOLDER entries, all profiles by default")
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=['speeds'])
+    parser.add_argument('--workers', type=int, help="Maximum worker processes, the CPU count by default")
+    parser.add_argument('--memory-gb', type=float, help="Memory budget, by default a share of the available memory")
+    parser.add_argument('--summary', help="CSV file to write the summary to")
+    args = parser.parse_args()
+
+    jobs = [parse_job(entry) for entry in args.feeds or CITY_PROFILES]
+    memory_budget = args.memory_gb * 2**30 if args.memory_gb else None
+    rows = run_batch(jobs, args.kinds, args.workers, memory_budget)
+
+    summary = print_summary(rows)
+    if args.summary:
+        summary.to_csv(args.summary, index=False)
+
+
+if __name__ == "__main__":
+    main()
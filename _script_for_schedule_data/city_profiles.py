@@ -0,0 +1,105 @@
+from gtfs_time import PEAK_WINDOWS
+
+SCHEDULE_DATA = "C:\\Users\\Asus\\OneDrive\\Pulpit\\Rozne\\QGIS\\TransitLineSpeeds\\_schedule_data\\"
+
+# What sets the cities' feeds apart, read by pipeline.py:
+# - folder_path: the extracted feed or feed.zip, outputs are written next to it
+# - time_mode: how times at or past 24:00:00 are handled, see gtfs_time.OVERFLOW_MODES
+# - count_time_mode: the same for trip counts (None for time_mode)
+# - distance_factor: multiplies shape_dist_traveled into kilometers (0.001 for feeds in meters)
+# - shape_distances: 'feed' to use shape_dist_traveled, 'project' to compute it (feeds without it)
+# - vehicle_type: 'route_id', 'shape_id', 'route_type' (from routes.txt) or a fixed vehicle name
+# - speed_matching: how shape points take stop speeds, see speeds.shape_speeds
+# - running_speed: also measure the running speed (departure to next arrival, without dwell) and stop dwell times
+# - windows: times of day a trip must touch to be used for speeds (None for the whole day)
+# - count_windows: the same for trip counts
+# - speed_bands: None, or split speeds by the time band each stretch starts in, see gtfs_time.speed_bands
+#   ('day', 'hourly' or a list of (name, start, end)); all trips of the day are used, ignoring windows
+# - service: which trips are counted, ('date', YYYYMMDD or a list of them) resolved with the feed's calendar
+#   (see service_calendar), the older ('calendar_start_date', date) and ('trip_id_contains', text), or None for all
+# - service_id_separator: trips' service_ids end with the calendar service_id after it
+# - speed_service: also measure speeds on the service's trips only (by default speeds use all trips)
+# - shape_id_separator: trips list several shape_ids joined by it, the first one is used
+# - crs: metric CRS of stages 02 and 03
+# - timezone: local time of the city, for the UTC timestamps of live positions (see observed_speeds)
+# - output_format: format of the layers of stages 02 and 03, 'parquet' (GeoParquet), 'fgb' (FlatGeobuf)
+#   or 'shapefile' (the older format), see layer_io.OUTPUT_FORMATS
+DEFAULT_PROFILE = {
+    'time_mode': 'drop',
+    'count_time_mode': None,
+    'distance_factor': 1,
+    'shape_distances': 'feed',
+    'vehicle_type': 'route_type',
+    'speed_matching': 'bfill',
+    'running_speed': False,
+    'windows': PEAK_WINDOWS,
+    'count_windows': PEAK_WINDOWS,
+    'speed_bands': None,
+    'service': None,
+    'service_id_separator': None,
+    'speed_service': False,
+    'shape_id_separator': None,
+    'crs': 'EPSG:2180',
+    'timezone': 'Europe/Warsaw',
+    'output_format': 'parquet',
+}
+
+CITY_PROFILES = {
+    'Warszawa': {
+        'folder_path': SCHEDULE_DATA + "Warszawa_2024_11_10\\",
+        'vehicle_type': 'route_id',
+        'speed_matching': 'nearest',
+        'service': ('date', '20241113'),  # Wednesday, service '5_2'
+        'service_id_separator': ':',
+    },
+    'Praga': {
+        'folder_path': SCHEDULE_DATA + "Praga_2023_01_23\\",
+        'crs': 'EPSG:32633',
+        'timezone': 'Europe/Prague',
+    },
+    'Wieden': {
+        'folder_path': SCHEDULE_DATA + "Praga_2023_10_23\\",
+        'distance_factor': 0.001,
+        'crs': 'EPSG:32633',
+        'timezone': 'Europe/Vienna',
+    },
+    'Oslo': {
+        'folder_path': SCHEDULE_DATA + "Oslo_2024_01_24\\",
+        'distance_factor': 0.001,
+        'crs': 'EPSG:32632',
+        'timezone': 'Europe/Oslo',
+    },
+    'Gdansk': {
+        'folder_path': SCHEDULE_DATA + "Gdansk_2024_03_20\\",
+        'count_time_mode': 'wrap',  # Only the counts wrapped times past midnight, speeds dropped them
+        'shape_distances': 'project',
+        'vehicle_type': 'shape_id',
+        'speed_matching': 'forward',
+        'count_windows': None,
+        'service': ('date', '20240320'),
+    },
+    'Gdynia': {
+        'folder_path': SCHEDULE_DATA + "Gdynia_2024_03_20\\",
+        'count_time_mode': 'wrap',  # Only the counts wrapped times past midnight, speeds dropped them
+        'vehicle_type': 'Bus',
+        'count_windows': None,
+        'service': ('date', '20240320'),
+        'shape_id_separator': ',',
+    },
+    'NY': {
+        'folder_path': SCHEDULE_DATA + "NY_2024_03_21\\",
+        'count_time_mode': 'wrap',  # Only the counts wrapped times past midnight, speeds dropped them
+        'vehicle_type': 'Bus',
+        'count_windows': [('06:00:00', '22:00:00')],
+        'service': ('date', '20240321'),
+        'crs': 'EPSG:32618',
+        'timezone': 'America/New_York',
+    },
+}
+
+
+def city_profile(city, **overrides):
+    """The profile of a city with the defaults filled in; keyword arguments override single settings."""
+    if city not in CITY_PROFILES:
+        raise KeyError(f"Unknown city {city!r}, expected one of {', '.join(CITY_PROFILES)}")
+    return {**DEFAULT_PROFILE, 'city': city, **CITY_PROFILES[city], **overrides}
@@ -0,0 +1,260 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+try:
+    from numba import njit
+except ImportError:  # Numba is optional, the kernels also run as plain Python
+    def njit(function):
+        return function
+
+from segments import segment_directions
+from speeds import RUNNING_SPEED, DELTA_LAYERS
+
+BUFFER_DISTANCE = 4  # Segments closer than this (in meters) can belong to the same corridor
+MAX_DIRECTION_DIFF = 10  # Maximum difference of direction (in degrees) for parallel segments
+BUFFER_QUAD_SEGS = 16  # Buffer resolution of the old scripts' geometry.buffer, so buffer bounds are the same
+TILE_SIZE = 5000  # Side (in meters) of the square tiles large groups are split into for parallel work
+MIN_TILED_SEGMENTS = 50_000  # Groups with fewer segments are not split into tiles
+
+
+def line_directions(geometries):
+    """Azimuth from the first to the last vertex of every line, in degrees within [0, 360)."""
+    start = shapely.get_coordinates(shapely.get_point(geometries, 0))
+    end = shapely.get_coordinates(shapely.get_point(geometries, -1))
+    return segment_directions(end[:, 0] - start[:, 0], end[:, 1] - start[:, 1])
+
+
+def direction_difference(a, b):
+    """Smallest angle between two directions in degrees, so 359 and 1 are 2 degrees apart."""
+    difference = np.abs(np.asarray(a) - np.asarray(b)) % 360
+    return np.minimum(difference, 360 - difference)
+
+
+def parallel_pairs(gdf, distance=BUFFER_DISTANCE, max_direction_diff=MAX_DIRECTION_DIFF, directions=None,
+                   bounding_boxes=False, rows=None):
+    """
+    All (i, j) positions of distinct segments lying within distance of each other and running
+    in the same direction, from one bulk spatial index query instead of a query per segment.
+    directions defaults to the azimuth of each geometry. With bounding_boxes=True a pair only needs
+    the bounding box of the buffered segment to hit the other segment's bounding box, like the
+    old per-segment sindex.intersection(buffer.bounds) loops (see tests/test_corridors.py).
+    rows limits i to those positions (the segments a tile owns), j can be any segment.
+    Pairs come out sorted by i, then j.
+    """
+    geometries = gdf.geometry.values
+    query = geometries if rows is None else geometries[rows]
+    if bounding_boxes:
+        i, j = gdf.sindex.query(shapely.buffer(query, distance, quad_segs=BUFFER_QUAD_SEGS))
+    else:
+        i, j = gdf.sindex.query(query, predicate='dwithin', distance=distance)
+    if rows is not None:
+        i = np.asarray(rows)[i]
+    keep = i != j
+
+    if directions is None:
+        directions = line_directions(geometries)
+    directions = np.asarray(directions, dtype=float)
+    keep &= direction_difference(directions[i], directions[j]) <= max_direction_diff
+
+    order = np.lexsort((j[keep], i[keep]))
+    return i[keep][order], j[keep][order]
+
+
+def overlapping_pairs(gdf, distance=BUFFER_DISTANCE, max_direction_diff=MAX_DIRECTION_DIFF, rows=None):
+    """
+    Parallel pairs (see parallel_pairs) where the midpoint of j lies within distance of i, so
+    consecutive pieces of a single line, which only touch at their ends, are not paired.
+    """
+    i, j = parallel_pairs(gdf, distance, max_direction_diff, rows=rows)
+    geometries = gdf.geometry.values
+    overlapping = shapely.dwithin(shapely.line_interpolate_point(geometries[j], 0.5, normalized=True),
+                                  geometries[i], distance)
+    return i[overlapping], j[overlapping]
+
+
+def spatial_tiles(geometries, tile_size=TILE_SIZE):
+    """Positions of the geometries grouped by the square tile holding the centre of their bounding box."""
+    bounds = shapely.bounds(geometries)
+    centres = (bounds[:, :2] + bounds[:, 2:]) / 2
+    keys = np.floor(centres / tile_size).astype(np.int64)
+    _, tile_of, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    order = np.argsort(tile_of.ravel(), kind='stable')
+    return np.split(order, np.cumsum(counts)[:-1])
+
+
+def _tile_pairs(geometries, directions, owned, index, distance, max_direction_diff, bounding_boxes, overlap):
+    """Pairs of the segments a tile owns, found among the tile's candidates and returned as global positions."""
+    tile = gpd.GeoSeries(geometries)
+    if overlap:
+        i, j = overlapping_pairs(tile, distance, max_direction_diff, rows=owned)
+    else:
+        i, j = parallel_pairs(tile, distance, max_direction_diff, directions, bounding_boxes, rows=owned)
+    return index[i], index[j]
+
+
+def find_pairs(gdf, distance=BUFFER_DISTANCE, max_direction_diff=MAX_DIRECTION_DIFF, directions=None,
+               bounding_boxes=False, overlap=False, executor=None, tile_size=TILE_SIZE):
+    """
+    parallel_pairs (or overlapping_pairs with overlap=True) of a whole group, split into spatial
+    tiles run on the executor when the group has at least MIN_TILED_SEGMENTS segments.
+    A tile owns the segments centred in it and searches their partners among all segments
+    reaching within distance of them, so pairs across tile borders are found exactly once, by
+    the tile owning i. The merged pairs are sorted by i, then j, the same as without tiles.
+    """
+    if executor is None or len(gdf) < MIN_TILED_SEGMENTS:
+        if overlap:
+            return overlapping_pairs(gdf, distance, max_direction_diff)
+        return parallel_pairs(gdf, distance, max_direction_diff, directions, bounding_boxes)
+
+    geometries = gdf.geometry.values
+    if directions is None:
+        directions = line_directions(geometries)
+    directions = np.asarray(directions, dtype=float)
+
+    futures = []
+    for owned in spatial_tiles(geometries, tile_size):
+        # Every segment whose bounding box comes within distance of the owned segments' extent
+        min_x, min_y, max_x, max_y = shapely.total_bounds(geometries[owned])
+        reach = shapely.box(min_x - distance, min_y - distance, max_x + distance, max_y + distance)
+        candidates = np.unique(np.concatenate([owned, gdf.sindex.query(reach)]))
+        futures.append(executor.submit(_tile_pairs, geometries[candidates], directions[candidates],
+                                       np.searchsorted(candidates, owned), candidates,
+                                       distance, max_direction_diff, bounding_boxes, overlap))
+
+    i = np.concatenate([future.result()[0] for future in futures])
+    j = np.concatenate([future.result()[1] for future in futures])
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+def cluster_segments(gdf, distance=BUFFER_DISTANCE, max_direction_diff=MAX_DIRECTION_DIFF, executor=None,
+                     tile_size=TILE_SIZE):
+    """
+    Labels parallel, overlapping segments with a shared corridor id (connected components
+    of overlapping_pairs). Tiles only find the pairs; the components are taken over all of
+    them at once, so corridors spanning several tiles keep one label.
+    """
+    i, j = find_pairs(gdf, distance, max_direction_diff, overlap=True, executor=executor, tile_size=tile_size)
+    return pair_components(len(gdf), i, j)
+
+
+def pair_components(n, i, j):
+    """Connected components of n segments linked by the (i, j) pairs, numbered in order of first segment."""
+    adjacency = coo_matrix((np.ones(len(i), dtype=bool), (i, j)), shape=(n, n))
+    _, labels = connected_components(adjacency, directed=False)
+    return pd.factorize(labels)[0]
+
+
+def aggregate_speeds(gdf, distance=BUFFER_DISTANCE, max_direction_diff=MAX_DIRECTION_DIFF, executor=None,
+                     tile_size=TILE_SIZE):
+    """
+    One row per corridor cluster of at least two segments, drawn with its longest segment.
+    speed is the plain mean of the segment speeds, speed_w the mean weighted by segment length,
+    n_seg the number of segments; a running speed layer gets the same two means, the layers
+    comparing observed with scheduled speeds (speeds.DELTA_LAYERS) the plain mean. The result does
+    not depend on the order of the input rows beyond tie-breaking between equally long segments.
+    executor spreads large groups over tiles.
+    """
+    gdf = gdf.reset_index(drop=True)
+    return summarize_speed_clusters(gdf, cluster_segments(gdf, distance, max_direction_diff, executor, tile_size))
+
+
+def summarize_speed_clusters(gdf, labels):
+    """The corridor rows of aggregate_speeds from the cluster label of every segment (gdf with a default index)."""
+    lengths = gdf.geometry.length.to_numpy()
+    speeds = gdf['speed'].to_numpy(dtype=float)
+
+    stats = pd.DataFrame({'cluster': labels, 'speed': speeds, 'weighted': speeds * lengths, 'length': lengths})
+    layers = ['speed']
+    if RUNNING_SPEED in gdf:
+        # Running speeds may be missing, their weighted mean only counts the segments having one
+        running = gdf[RUNNING_SPEED].to_numpy(dtype=float)
+        stats['running'] = running
+        stats['running_weighted'] = running * lengths
+        stats['running_length'] = np.where(np.isnan(running), np.nan, lengths)
+        layers.append(RUNNING_SPEED)
+    # Layers comparing observed with scheduled speeds (see speed_delta) only get the plain mean
+    delta_layers = [layer for layer in DELTA_LAYERS if layer in gdf]
+    for layer in delta_layers:
+        stats[layer] = gdf[layer].to_numpy(dtype=float)
+    layers += delta_layers
+    grouped = stats.groupby('cluster')
+    clusters = pd.DataFrame({
+        'speed': grouped['speed'].mean(),
+        'speed_w': grouped['weighted'].sum() / grouped['length'].sum(),
+        'n_seg': grouped.size(),
+    })
+    if RUNNING_SPEED in gdf:
+        clusters[RUNNING_SPEED] = grouped['running'].mean()
+        clusters[f'{RUNNING_SPEED}_w'] = grouped['running_weighted'].sum() / grouped['running_length'].sum().replace(0, np.nan)
+    for layer in delta_layers:
+        clusters[layer] = grouped[layer].mean()
+
+    # Longest segment of each cluster represents it (first one on ties)
+    representative = stats.sort_values(['cluster', 'length'], ascending=[True, False], kind='stable')
+    representative = representative.groupby('cluster').head(1).index.to_numpy()
+
+    result = gdf.iloc[representative].drop(columns=layers).reset_index(drop=True)
+    result = result.join(clusters.loc[labels[representative]].reset_index(drop=True))
+    result = result[result['n_seg'] > 1]
+    return gpd.GeoDataFrame(result, geometry=gdf.geometry.name, crs=gdf.crs).reset_index(drop=True)
+
+
+@njit
+def _absorb_neighbours(indptr, neighbours, trip_counts):
+    """
+    Greedy pass over segments sorted from longest to shortest: each segment not yet absorbed
+    takes the trip counts of its not yet absorbed parallel neighbours (CSR arrays of pairs).
+    """
+    n = len(trip_counts)
+    processed = np.zeros(n, dtype=np.bool_)
+    kept = np.zeros(n, dtype=np.bool_)
+    trip_sum = np.zeros(n, dtype=np.float64)
+
+    for i in range(n):
+        if processed[i]:
+            continue
+        total = trip_counts[i]
+        for k in range(indptr[i], indptr[i + 1]):
+            j = neighbours[k]
+            if not processed[j]:
+                total += trip_counts[j]
+                processed[j] = True
+        processed[i] = True
+        kept[i] = True
+        trip_sum[i] = total
+
+    return kept, trip_sum
+
+
+def longest_first(lengths):
+    """Positions from the longest to the shortest segment, equal lengths in input order."""
+    return np.argsort(-np.asarray(lengths, dtype=float), kind='stable')
+
+
+def absorb_trip_counts(gdf, i, j):
+    """kept flags and trip_sum of segments sorted from longest to shortest, given their sorted neighbour pairs."""
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(i, minlength=len(gdf)))])
+    return _absorb_neighbours(indptr, j, gdf['trip_count'].to_numpy(dtype=np.float64))
+
+
+def aggregate_trip_counts(gdf, distance=BUFFER_DISTANCE, max_direction_diff=MAX_DIRECTION_DIFF, executor=None,
+                          tile_size=TILE_SIZE):
+    """
+    Sums trip_count over parallel segments: the longest segment absorbs its neighbours
+    (bounding box of a 4 m buffer, direction within 10 degrees, 'direction' column) and keeps
+    their total as trip_sum; absorbed segments are not written. Segments with trip_sum of 0 are dropped.
+    executor spreads the neighbour search of large groups over tiles; the greedy pass itself
+    runs once over all pairs, in the same order as without tiles.
+    """
+    gdf = gdf.iloc[longest_first(gdf['length'])].reset_index(drop=True)
+    i, j = find_pairs(gdf, distance, max_direction_diff, directions=gdf['direction'], bounding_boxes=True,
+                      executor=executor, tile_size=tile_size)
+
+    kept, trip_sum = absorb_trip_counts(gdf, i, j)
+    result = gdf[kept].assign(trip_sum=trip_sum[kept])
+    return result[result['trip_sum'] > 0].reset_index(drop=True)
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+from gtfs_feed import feed_files_key, read_feed_table
+from gtfs_time import SECONDS_PER_DAY, assign_bands, band_windows, parse_times, window_edges
+
+FREQUENCIES_USECOLS = ['trip_id', 'start_time', 'end_time', 'headway_secs']
+
+# Parsed frequencies.txt by feed, read once for both counts and speeds
+_frequencies_cache = {}
+
+
+def _read_frequencies(folder_path):
+    try:
+        frequencies = read_feed_table(folder_path, "frequencies.txt", usecols=FREQUENCIES_USECOLS, dtype={'trip_id': str})
+    except FileNotFoundError:
+        return None
+    start, end = parse_times(frequencies['start_time']), parse_times(frequencies['end_time'])
+    headway = pd.to_numeric(frequencies['headway_secs'], errors='coerce')
+    valid = (start.notna() & end.notna() & (headway > 0)).to_numpy()
+    frequencies = pd.DataFrame({'trip_id': frequencies['trip_id'], 'start_time': start, 'end_time': end,
+                                'headway_secs': headway})[valid]
+    if frequencies.empty:
+        return None
+    return frequencies.astype({'start_time': np.int64, 'end_time': np.int64, 'headway_secs': np.int64}).reset_index(drop=True)
+
+
+def load_frequencies(folder_path):
+    """
+    frequencies.txt of a feed with start_time and end_time in seconds since the service day start
+    (past 24:00:00 kept), or None when the feed has none. Rows with a missing time or a headway
+    that is not positive are dropped. exact_times is not read: either way a trip runs every
+    headway_secs. Cached per feed.
+    """
+    key = feed_files_key(folder_path, ("frequencies.txt",))
+    if key not in _frequencies_cache:
+        _frequencies_cache[key] = _read_frequencies(folder_path)
+    return _frequencies_cache[key]
+
+
+def frequency_trip_ids(frequencies):
+    """The trip_ids run by frequencies (whose stop_times only give the pattern of their virtual trips), None without any."""
+    return None if frequencies is None else frequencies['trip_id'].unique()
+
+
+def departure_counts(frequencies):
+    """Number of virtual trips of every frequencies row: one every headway_secs from start_time, before end_time."""
+    start, end = frequencies['start_time'].to_numpy(), frequencies['end_time'].to_numpy()
+    return np.maximum(-((start - end) // frequencies['headway_secs'].to_numpy()), 0)
+
+
+def expand_departures(frequencies, mode='keep'):
+    """
+    Departures (seconds) of all virtual trips of frequencies from their first stop, as integer
+    arrays (row, departure) with the position of the frequencies row of every departure.
+    With mode 'drop' departures at or past 24:00:00 are left out, like the stop_times of that
+    mode (see gtfs_time.parse_stop_times).
+    """
+    counts = departure_counts(frequencies)
+    rows = np.repeat(np.arange(len(frequencies)), counts)
+    step = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    departures = frequencies['start_time'].to_numpy()[rows] + step * frequencies['headway_secs'].to_numpy()[rows]
+    if mode == 'drop':
+        keep = departures < SECONDS_PER_DAY
+        rows, departures = rows[keep], departures[keep]
+    return rows, departures
+
+
+def trip_spans(stop_times, frequencies):
+    """
+    first_departure and duration (from it to the last arrival, seconds) of the frequency-based
+    trips of stop_times, indexed by trip_id. Virtual trips keep the times relative to the first
+    departure; the first departure itself is replaced by theirs.
+    """
+    templates = stop_times[stop_times['trip_id'].isin(frequency_trip_ids(frequencies))]
+    by_trip = templates.groupby('trip_id', observed=True)
+    first_departure = by_trip['departure_time'].min().astype(np.int64)
+    spans = pd.DataFrame({'first_departure': first_departure,
+                          'duration': by_trip['arrival_time'].max().astype(np.int64) - first_departure})
+    spans.index = spans.index.astype(str)
+    return spans
+
+
+def running_in_windows(departures, durations, windows):
+    """
+    Mask of the virtual trips (departure and duration, seconds) running during one of the windows,
+    from their departure to their last arrival, by clock time like gtfs_time.window_labels.
+    """
+    starts, ends, _ = window_edges(windows)
+    start = departures % SECONDS_PER_DAY
+    end = start + durations
+    # First window ending at or after the departure; the trip reaches it if it starts before the trip ends
+    window = np.searchsorted(ends, start, side='left')
+    hit = (window < len(ends)) & (starts[np.minimum(window, len(ends) - 1)] <= end)
+    # Trips running past midnight also reach the first windows of the next day
+    return hit | ((end >= SECONDS_PER_DAY) & (starts[0] <= end - SECONDS_PER_DAY))
+
+
+def virtual_trip_counts(frequencies, windows=None, spans=None, mode='keep'):
+    """
+    Number of virtual trips of every frequency-based trip_id, as a Series. With windows only the
+    trips running during one of them are counted, for how long comes from spans (see trip_spans;
+    without them the departure alone must be inside a window). Regular trips are kept when one of
+    their stop times is inside a window, which only differs for windows shorter than a stretch.
+    """
+    rows, departures = expand_departures(frequencies, mode)
+    trip_ids = frequencies['trip_id'].to_numpy()[rows]
+    if windows is not None:
+        durations = np.zeros(len(departures), dtype=np.int64)
+        if spans is not None:
+            durations = spans['duration'].reindex(trip_ids).fillna(0).to_numpy(dtype=np.int64)
+        trip_ids = trip_ids[running_in_windows(departures, durations, windows)]
+    counts = pd.Series(trip_ids, dtype=object).value_counts()
+    return counts.reindex(frequency_trip_ids(frequencies), fill_value=0).rename_axis('trip_id').rename('trips')
+
+
+def trip_weights(trip_ids, counts):
+    """How many trips every row's trip_id stands for: its virtual trip counts if frequency-based, otherwise 1."""
+    trip_ids = pd.Series(trip_ids, copy=False)
+    if isinstance(trip_ids.dtype, pd.CategoricalDtype):
+        # Looked up once per category rather than per row
+        by_category = counts.reindex(trip_ids.cat.categories.astype(str)).fillna(1).to_numpy(dtype=np.int64)
+        codes = trip_ids.cat.codes.to_numpy()
+        return np.where(codes >= 0, by_category[codes], 1)
+    return trip_ids.astype(str).map(counts).fillna(1).to_numpy(dtype=np.int64)
+
+
+def band_stretch_weights(stretches, frequencies, spans, bands, mode='keep'):
+    """
+    The stretches of frequency-based trips (see speeds.calculate_speeds) once per band their virtual
+    trips start them in, with the categorical 'band' and the number of virtual trips as 'weight'.
+    The virtual starts of a stretch are an arithmetic series per frequencies row, so they are
+    counted in every band directly instead of being expanded.
+    """
+    starts, ends, labels = window_edges(band_windows(bands))
+    trip_ids = stretches['trip_id'].astype(str).to_numpy()
+    offset = stretches['prev_departure_time'].to_numpy(dtype=np.int64) - spans['first_departure'].reindex(trip_ids).to_numpy()
+    pairs = pd.DataFrame({'_stretch': np.arange(len(stretches)), 'trip_id': trip_ids, '_offset': offset})
+    pairs = pairs.dropna(subset=['_offset']).merge(frequencies, on='trip_id')
+
+    first = pairs['start_time'].to_numpy() + pairs['_offset'].to_numpy(dtype=np.int64)
+    headway = pairs['headway_secs'].to_numpy()
+    last_step = departure_counts(pairs) - 1
+    if mode == 'drop':
+        shifts = [0]  # Bands end before 24:00:00, so starts past it are not counted
+    else:
+        # Compared by clock time: a band also covers the same hours of the following days
+        latest = (first + last_step * headway).max() if len(pairs) else 0
+        shifts = range(0, int(latest) + 1, SECONDS_PER_DAY)
+
+    weights = np.zeros((len(stretches), len(bands)), dtype=np.int64)
+    for shift in shifts:
+        for start, end, band in zip(starts, ends, labels):
+            low = np.maximum(-((first - start - shift) // headway), 0)
+            high = np.minimum((end + shift - first) // headway, last_step)
+            np.add.at(weights[:, band], pairs['_stretch'].to_numpy(), np.maximum(high - low + 1, 0))
+
+    stretch, band = np.nonzero(weights)
+    return stretches.iloc[stretch].assign(band=pd.Categorical.from_codes(band, [name for name, _, _ in bands]),
+                                          weight=weights[stretch, band])
+
+
+def weigh_virtual_trips(stretches, frequencies, spans, windows=None, bands=None, mode='keep'):
+    """
+    Adds the 'weight' speeds.speed_sums counts every stretch with: the stretches of a frequency-based
+    trip stand for all its virtual trips (those running during windows), regular trips weigh 1.
+    With bands, stretches get their 'band' as with gtfs_time.assign_bands, those of virtual
+    trips split over the bands their starts fall in (see band_stretch_weights).
+    Stretches weighing nothing are dropped.
+    """
+    if bands is None:
+        counts = virtual_trip_counts(frequencies, windows, spans, mode)
+        stretches = stretches.assign(weight=trip_weights(stretches['trip_id'], counts))
+    else:
+        templates = stretches['trip_id'].isin(frequency_trip_ids(frequencies)).to_numpy()
+        stretches = pd.concat([assign_bands(stretches[~templates], bands).assign(weight=1),
+                               band_stretch_weights(stretches[templates], frequencies, spans, bands, mode)])
+    return stretches[stretches['weight'] > 0]
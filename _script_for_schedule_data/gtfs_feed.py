@@ -0,0 +1,144 @@
+import os
+import zipfile
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+FEED_ZIP = "feed.zip"  # Name used by curl_to_download_GTFS.txt
+CHUNK_SIZE = 1_000_000  # Rows per chunk when streaming large tables
+
+# Columns the scripts actually use from the large GTFS tables (shapes are read whole,
+# as all their columns end up in shapes_processed.csv)
+TRIPS_USECOLS = ['route_id', 'service_id', 'trip_id', 'shape_id']
+STOP_TIMES_USECOLS = ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence', 'shape_dist_traveled']
+STOPS_USECOLS = ['stop_id', 'stop_lat', 'stop_lon']
+
+# Compact in-memory form of the tables: ids as categoricals (int32 codes or smaller, each distinct
+# string stored once), distances as float32; times are int32 seconds (see gtfs_time.parse_stop_times)
+ID_COLUMNS = ['route_id', 'service_id', 'trip_id', 'shape_id', 'stop_id']
+DISTANCE_DTYPE = 'float32'
+
+
+def feed_source(folder_path, name):
+    """
+    Returns the file a GTFS table is read from: the extracted name (e.g. stop_times.txt)
+    if it exists in folder_path, otherwise the feed zip archive.
+    """
+    extracted_path = os.path.join(folder_path, name)
+    if os.path.exists(extracted_path):
+        return extracted_path
+
+    zip_path = os.path.join(folder_path, FEED_ZIP)
+    if os.path.exists(zip_path):
+        return zip_path
+
+    raise FileNotFoundError(f"Neither {name} nor {FEED_ZIP} found in {folder_path}")
+
+
+def feed_files_key(folder_path, names):
+    """
+    Identifies the files the tables names are read from by path, size and mtime (tables the feed
+    lacks are left out), so tables cached under it are read again when the feed is updated.
+    """
+    key = []
+    for name in names:
+        try:
+            path = feed_source(folder_path, name)
+        except FileNotFoundError:
+            continue
+        stat = os.stat(path)
+        key.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return tuple(key)
+
+
+def _find_member(archive, name):
+    """Finds a table in the archive, also when the feed was zipped inside a subfolder."""
+    for member in archive.namelist():
+        if os.path.basename(member) == name:
+            return member
+    raise FileNotFoundError(f"{name} not found in {archive.filename}")
+
+
+def iter_feed_table(folder_path, name, usecols=None, dtype=None, chunksize=CHUNK_SIZE):
+    """
+    Streams a GTFS table in chunks of chunksize rows, straight out of the zip when the feed
+    is not extracted. Only usecols are parsed; columns missing from the feed are skipped.
+    """
+    source = feed_source(folder_path, name)
+    read_kwargs = {'dtype': dtype, 'chunksize': chunksize, 'encoding': 'utf-8-sig'}
+    if usecols is not None:
+        wanted = set(usecols)
+        read_kwargs['usecols'] = lambda column: column in wanted
+
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            with archive.open(_find_member(archive, name)) as member:
+                yield from pd.read_csv(member, **read_kwargs)
+    else:
+        yield from pd.read_csv(source, **read_kwargs)
+
+
+def read_feed_table(folder_path, name, usecols=None, dtype=None, chunksize=CHUNK_SIZE, transform=None):
+    """
+    Reads a whole GTFS table into one DataFrame (see iter_feed_table).
+    transform, if given, is applied to every chunk before concatenating, so e.g. time parsing
+    and filtering happen while the raw text columns of only one chunk are held in memory.
+    """
+    chunks = []
+    for chunk in iter_feed_table(folder_path, name, usecols, dtype, chunksize):
+        if transform is not None:
+            chunk = transform(chunk)
+        chunks.append(chunk)
+    if not chunks:
+        return pd.DataFrame(columns=usecols)
+    return concat_chunks(chunks)
+
+
+def concat_chunks(chunks):
+    """Concatenates chunks, merging the categories of categorical columns instead of falling back to strings."""
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    categorical = [column for column, dtype in chunks[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    merged = {column: union_categoricals([chunk[column] for chunk in chunks], sort_categories=True)
+              for column in categorical}
+    df = pd.concat([chunk.drop(columns=categorical) for chunk in chunks], ignore_index=True)
+    for column in categorical:
+        df[column] = merged[column]
+    return df[chunks[0].columns]
+
+
+def compact_ids(df, columns=ID_COLUMNS):
+    """Stores the id columns present in df as categoricals."""
+    for column in columns:
+        if column in df and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def compact_distances(df, factor=1):
+    """Stores shape_dist_traveled (if present) as float32, after multiplying it by factor (unit conversion)."""
+    if 'shape_dist_traveled' in df:
+        df['shape_dist_traveled'] = (pd.to_numeric(df['shape_dist_traveled'], errors='coerce') * factor).astype(DISTANCE_DTYPE)
+    return df
+
+
+def share_categories(frames, column):
+    """
+    Gives column the same categories (their union) in all frames, so merges, isin and merge_asof
+    by it compare integer codes; values missing from a frame's categories are not lost.
+    """
+    categories = pd.Index([])
+    for df in frames:
+        categories = categories.union(pd.Index(df[column].cat.categories))
+    dtype = pd.CategoricalDtype(categories)
+    for df in frames:
+        df[column] = df[column].astype(dtype)
+
+
+def feed_table_size(folder_path, name):
+    """Uncompressed size in bytes of a GTFS table, read from the zip directory when not extracted."""
+    source = feed_source(folder_path, name)
+    if source.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            return archive.getinfo(_find_member(archive, name)).file_size
+    return os.path.getsize(source)
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+SECONDS_PER_DAY = 24 * 3600
+
+# What to do with GTFS times at or past 24:00:00 (trips running after midnight):
+# - 'drop': remove the row (speeds of every city, counts of Warszawa, Praga, Oslo, Wieden)
+# - 'wrap': fold the hour back with modulo 24 (counts of Gdansk, Gdynia, NY)
+# - 'keep': keep seconds since the service day start as they are
+OVERFLOW_MODES = ('drop', 'wrap', 'keep')
+
+
+def time_to_seconds(t):
+    """Converts a single HH:MM:SS string into seconds since the service day start."""
+    hours, minutes, seconds = map(int, t.strip().split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_times(times):
+    """
+    Vectorized version of time_to_seconds for a whole column of HH:MM:SS strings.
+    Hours of 24 or more are kept as they are (e.g. 25:10:00 -> 90600).
+    Missing or malformed values become NaN, so the result is float64.
+    """
+    times = pd.Series(times, copy=False)
+    parts = times.astype(str).str.strip().str.split(':', n=2, expand=True)
+    parts = parts.reindex(columns=range(3))
+    hours, minutes, seconds = (pd.to_numeric(parts[i], errors='coerce') for i in range(3))
+
+    seconds_total = hours * 3600 + minutes * 60 + seconds
+    return seconds_total.mask(times.isna() | (minutes >= 60) | (seconds >= 60) | (seconds_total < 0))
+
+
+def parse_stop_times(stop_times, mode='drop', columns=('arrival_time', 'departure_time')):
+    """
+    Replaces the HH:MM:SS columns of stop_times with int32 seconds since the service day start.
+    mode decides what happens to times at or past 24:00:00 (see OVERFLOW_MODES).
+    Rows with a missing or malformed time in any of the columns are dropped.
+    """
+    if mode not in OVERFLOW_MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {OVERFLOW_MODES}")
+
+    stop_times = stop_times.copy()
+    valid = np.ones(len(stop_times), dtype=bool)
+
+    for column in columns:
+        seconds = parse_times(stop_times[column])
+        valid &= seconds.notna().to_numpy()
+
+        if mode == 'drop':
+            valid &= (seconds < SECONDS_PER_DAY).to_numpy()
+        elif mode == 'wrap':
+            seconds = seconds % SECONDS_PER_DAY
+
+        stop_times[column] = seconds
+
+    stop_times = stop_times[valid]
+    for column in columns:
+        stop_times[column] = stop_times[column].astype(np.int32)
+
+    return stop_times
+
+
+# Peak windows used for the speed maps, both ends inclusive
+PEAK_WINDOWS = [('06:00:00', '11:00:00'), ('14:00:00', '19:00:00')]
+
+# Bands of the day speed profiles are split into, (name, start, end) with the start inclusive and
+# the end exclusive, so consecutive bands share their edges (see speed_bands)
+DAY_BANDS = [
+    ('night', '00:00:00', '06:00:00'),
+    ('am_peak', '06:00:00', '11:00:00'),
+    ('midday', '11:00:00', '14:00:00'),
+    ('pm_peak', '14:00:00', '19:00:00'),
+    ('evening', '19:00:00', '24:00:00'),
+]
+
+
+def _seconds(t):
+    return time_to_seconds(t) if isinstance(t, str) else int(t)
+
+
+def _end_seconds(t):
+    """Seconds of a window or band end; an end at 00:00:00 is midnight at the end of the day, like 24:00:00."""
+    return _seconds(t) or SECONDS_PER_DAY
+
+
+def window_edges(windows):
+    """
+    Turns (start, end) HH:MM:SS pairs (or seconds) into sorted, non-overlapping second intervals.
+    A window with start > end wraps past midnight and is split in two, both keeping its index.
+    A window ending at 00:00:00 runs to midnight, it does not wrap.
+    """
+    starts, ends, labels = [], [], []
+    for label, (start, end) in enumerate(windows):
+        start, end = _seconds(start), _end_seconds(end)
+        if start <= end:
+            pieces = [(start, end)]
+        else:  # Wraps around midnight.
+            pieces = [(start, SECONDS_PER_DAY - 1), (0, end)]
+        for piece_start, piece_end in pieces:
+            starts.append(piece_start)
+            ends.append(piece_end)
+            labels.append(label)
+
+    order = np.argsort(starts, kind='stable')
+    starts, ends, labels = np.array(starts)[order], np.array(ends)[order], np.array(labels)[order]
+    if np.any(starts[1:] <= ends[:-1]):
+        raise ValueError(f"Time windows overlap: {windows}")
+    return starts, ends, labels
+
+
+def window_labels(seconds, windows):
+    """
+    Index of the window each time falls into, or -1 if it is in none, in a single searchsorted pass.
+    Times past 24:00:00 are compared by their clock time, like the wrapping windows.
+    """
+    starts, ends, labels = window_edges(windows)
+    seconds = np.asarray(seconds) % SECONDS_PER_DAY
+
+    position = np.searchsorted(starts, seconds, side='right') - 1
+    candidate = np.clip(position, 0, None)
+    inside = (position >= 0) & (seconds <= ends[candidate])
+    return np.where(inside, labels[candidate], -1).astype(np.int16)
+
+
+def in_windows(seconds, windows):
+    """Boolean mask of the times falling into any of the windows."""
+    return window_labels(seconds, windows) >= 0
+
+
+def trip_windows(stop_times, windows, column='arrival_time'):
+    """
+    Unique (trip_id, window) pairs for trips with at least one stop time inside a window.
+    Selecting on 'window' gives the per-window trip sets (e.g. AM and PM peak) from one load.
+    """
+    labels = window_labels(stop_times[column].to_numpy(), windows)
+    hits = labels >= 0
+    # Selecting rows keeps a categorical trip_id compact
+    pairs = pd.DataFrame({'trip_id': stop_times['trip_id'].iloc[np.flatnonzero(hits)].reset_index(drop=True),
+                          'window': labels[hits]})
+    return pairs.drop_duplicates(ignore_index=True)
+
+
+def hour_bands():
+    """One band per hour of the day, named h00 to h23."""
+    return [(f"h{hour:02d}", f"{hour:02d}:00:00", f"{hour + 1:02d}:00:00") for hour in range(24)]
+
+
+def speed_bands(setting):
+    """The bands of a speed_bands profile setting: 'day' (DAY_BANDS), 'hourly' or a list of (name, start, end)."""
+    if setting == 'day':
+        return DAY_BANDS
+    if setting == 'hourly':
+        return hour_bands()
+    return list(setting)
+
+
+def band_labels(seconds, bands):
+    """
+    Index of the band each time falls into, or -1 if it is in none. Bands end before their end
+    time, which for whole seconds is the inclusive window ending a second earlier.
+    """
+    return window_labels(seconds, band_windows(bands))
+
+
+def band_windows(bands):
+    """The bands as inclusive (start, end) windows in seconds, their end a second before the band's."""
+    return [(_seconds(start), _end_seconds(end) - 1) for _, start, end in bands]
+
+
+def assign_bands(stretches, bands, column='prev_departure_time'):
+    """
+    Adds the categorical 'band' of every stretch (see speeds.calculate_speeds) from the time it
+    starts, its departure from the previous stop. Stretches starting outside all bands are dropped.
+    """
+    labels = band_labels(stretches[column].to_numpy(), bands)
+    stretches = stretches.assign(band=pd.Categorical.from_codes(labels, [name for name, _, _ in bands]))
+    return stretches[labels >= 0]
@@ -0,0 +1,347 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from city_profiles import city_profile, CITY_PROFILES
+from corridors import (absorb_trip_counts, cluster_segments, find_pairs, longest_first, pair_components,
+                       parallel_pairs, summarize_speed_clusters)
+from frequencies import load_frequencies
+from pipeline import (KINDS, compute_shape_speeds, corridor_groups, load_speed_inputs, read_stops, save_corridors,
+                      stage_01_counts, stage_02_segments)
+
+STATE_DIR = "incremental_{kind}"  # Created next to the feed, read back by the run on the next feed version
+STATE_VERSION = 4  # 2: fingerprints of float32 distances, 4: segments stored with their exact lengths
+SEGMENT_KEYS = ['shape_id', 'segment']  # Identify a segment across versions ('piece' is added for count pieces)
+COORDINATE_DECIMALS = 7  # Coordinates and distances (km) are rounded before hashing, so rewriting a feed
+DISTANCE_DECIMALS = 6  # with other float formatting does not change its fingerprints
+
+
+# ---- Fingerprints ----
+
+def _sum_by(keys, hashes):
+    """Order-independent hash per key: the wrapping uint64 sum of its row hashes."""
+    codes, uniques = pd.factorize(keys)
+    sums = np.zeros(len(uniques), dtype=np.uint64)
+    np.add.at(sums, codes, hashes)
+    return pd.Series(sums, index=uniques)
+
+
+def _row_hashes(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def geometry_fingerprints(shapes):
+    """Hash of the points of every shape_id (the sequence number keeps their order in the hash)."""
+    points = shapes[['shape_pt_sequence']].assign(
+        lat=shapes['shape_pt_lat'].round(COORDINATE_DECIMALS), lon=shapes['shape_pt_lon'].round(COORDINATE_DECIMALS))
+    if 'shape_dist_traveled' in shapes:
+        points['dist'] = shapes['shape_dist_traveled'].round(DISTANCE_DECIMALS)
+    return _sum_by(shapes['shape_id'], _row_hashes(points))
+
+
+def pattern_fingerprints(trips, stop_times, stops=None):
+    """
+    Hash of the stop_time patterns of every shape's trips: per trip its stops, distances and
+    times relative to the trip's first arrival, and the trip's vehicle. Trips with the same
+    pattern at other times of day count as often as they run. stops adds the stop positions,
+    for feeds whose distances are projected from them.
+    """
+    stop_times = stop_times.merge(trips[['trip_id', 'shape_id', 'vehicle']], on='trip_id', how='inner')
+    order = ['trip_id', 'stop_sequence'] if 'stop_sequence' in stop_times else ['trip_id', 'arrival_time']
+    stop_times = stop_times.sort_values(order, kind='stable')
+
+    by_trip = stop_times.groupby('trip_id', sort=False, observed=True)
+    first_arrival = by_trip['arrival_time'].transform('first')
+    rows = pd.DataFrame({
+        'position': by_trip.cumcount().to_numpy(),
+        'stop_id': stop_times['stop_id'].to_numpy(),
+        'arrival': (stop_times['arrival_time'] - first_arrival).to_numpy(),
+        'departure': (stop_times['departure_time'] - first_arrival).to_numpy(),
+        'vehicle': stop_times['vehicle'].to_numpy(),
+    })
+    if 'shape_dist_traveled' in stop_times:
+        rows['shape_dist_traveled'] = stop_times['shape_dist_traveled'].round(DISTANCE_DECIMALS).to_numpy()
+    if stops is not None:
+        stop_positions = stops.drop_duplicates('stop_id').set_index('stop_id')
+        rows['stop_lat'] = rows['stop_id'].map(stop_positions['stop_lat'].round(COORDINATE_DECIMALS)).to_numpy()
+        rows['stop_lon'] = rows['stop_id'].map(stop_positions['stop_lon'].round(COORDINATE_DECIMALS)).to_numpy()
+
+    trip_hashes = _sum_by(stop_times['trip_id'].to_numpy(), _row_hashes(rows))
+    # Rehash per trip, so rows of different trips cannot be swapped without changing the shape's hash
+    mixed = _row_hashes(pd.DataFrame({'trip': trip_hashes.to_numpy()}))
+    trip_shapes = trips.drop_duplicates('trip_id').set_index('trip_id')['shape_id']
+    return _sum_by(trip_shapes.loc[trip_hashes.index].to_numpy(), mixed)
+
+
+def frequency_fingerprints(trips, frequencies):
+    """Hash of the frequencies.txt rows of every shape's trips, which set how often its trips run."""
+    trip_shapes = trips.drop_duplicates('trip_id').set_index('trip_id')['shape_id']
+    position = pd.Index(trip_shapes.index.astype(str)).get_indexer(frequencies['trip_id'])
+    rows = frequencies[position >= 0]
+    return _sum_by(trip_shapes.iloc[position[position >= 0]].to_numpy(), _row_hashes(rows))
+
+
+def combine_fingerprints(*fingerprints):
+    """One fingerprint per shape_id from several per-shape hashes (0 where a shape has none)."""
+    combined = pd.concat(fingerprints, axis=1).fillna(0).astype(np.uint64)
+    return pd.Series(_row_hashes(combined), index=combined.index)
+
+
+def speed_fingerprints(shapes, trips, stop_times, stops=None, frequencies=None):
+    """
+    What stage 01 for speeds reads about every shape: its geometry, the patterns of its trips and
+    the frequencies of its frequency-based trips.
+    """
+    fingerprints = [geometry_fingerprints(shapes), pattern_fingerprints(trips, stop_times, stops)]
+    if frequencies is not None:
+        fingerprints.append(frequency_fingerprints(trips, frequencies))
+    return combine_fingerprints(*fingerprints)
+
+
+def processed_fingerprints(shapes_processed):
+    """Hash of every shape's stage-01 rows, for outputs cheap to compute but costly to aggregate (counts)."""
+    rows = shapes_processed.drop(columns=['shape_id'])
+    floats = rows.select_dtypes('float').columns
+    rows[floats] = rows[floats].round(COORDINATE_DECIMALS)
+    return _sum_by(shapes_processed['shape_id'], _row_hashes(rows))
+
+
+def changed_shapes(fingerprints, previous_fingerprints):
+    """shape_ids that are new, changed or gone since the previous fingerprints (all current ones without them)."""
+    if previous_fingerprints is None:
+        return set(fingerprints.index)
+    removed = set(previous_fingerprints.index) - set(fingerprints.index)
+    previous_fingerprints = previous_fingerprints.reindex(fingerprints.index)
+    changed = fingerprints.index[previous_fingerprints.isna() | (previous_fingerprints != fingerprints)]
+    return set(changed) | removed
+
+
+# ---- State of the previous version ----
+
+def _settings(profile, kind):
+    """The profile settings a state depends on; the folder and city may differ between versions."""
+    settings = {key: value for key, value in profile.items() if key not in ('folder_path', 'city')}
+    return json.loads(json.dumps({'version': STATE_VERSION, 'kind': kind, **settings}))
+
+
+def state_dir(folder_path, kind):
+    return os.path.join(folder_path, STATE_DIR.format(kind=kind))
+
+
+def save_state(profile, kind, fingerprints, shapes_processed, segments, groups):
+    """Writes what the next version reuses: fingerprints, stage-01 rows, segments and per-vehicle group states."""
+    directory = state_dir(profile['folder_path'], kind)
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith('group_'):
+            os.remove(os.path.join(directory, name))
+
+    fingerprints = pd.DataFrame({'shape_id': fingerprints.index.astype(str), 'fingerprint': fingerprints.to_numpy()})
+    feather.write_feather(fingerprints, os.path.join(directory, "fingerprints.arrow"), compression='uncompressed')
+    feather.write_feather(shapes_processed.reset_index(drop=True), os.path.join(directory, "shapes_processed.arrow"))
+    # Arrow keeps the float64 lengths exactly, which stage 03 orders the segments by
+    segments.reset_index(drop=True).to_feather(os.path.join(directory, "segments.arrow"))
+    for vehicle, gdf in groups.items():
+        gdf.reset_index(drop=True).to_feather(os.path.join(directory, f"group_{vehicle}.arrow"))
+
+    with open(os.path.join(directory, "meta.json"), 'w') as f:
+        json.dump({'settings': _settings(profile, kind), 'vehicles': sorted(groups)}, f, indent=2)
+
+
+def load_state(folder_path, profile, kind):
+    """The state saved by the previous version's run, or None if missing or made with other settings."""
+    directory = state_dir(folder_path, kind)
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        print(f"No incremental state in {folder_path}, processing everything")
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta['settings'] != _settings(profile, kind):
+        print(f"Incremental state in {folder_path} was made with other settings, processing everything")
+        return None
+
+    fingerprints = feather.read_table(os.path.join(directory, "fingerprints.arrow")).to_pandas()
+    return {
+        'fingerprints': fingerprints.set_index('shape_id')['fingerprint'],
+        'shapes_processed': feather.read_table(os.path.join(directory, "shapes_processed.arrow")).to_pandas(),
+        'segments': gpd.read_feather(os.path.join(directory, "segments.arrow")),
+        'groups': {vehicle: gpd.read_feather(os.path.join(directory, f"group_{vehicle}.arrow"))
+                   for vehicle in meta['vehicles']},
+    }
+
+
+# ---- Stage 03 by affected components ----
+
+def group_state(gdf, kind, executor=None):
+    """
+    Per segment of a vehicle group (in gdf order): its component in the neighbour graph stage 03
+    works on, and for counts whether it is kept and its trip_sum (see corridors.aggregate_trip_counts).
+    """
+    if kind == 'speeds':
+        return pd.DataFrame({'component': cluster_segments(gdf, executor=executor)})
+
+    order = longest_first(gdf['length'])
+    by_length = gdf.iloc[order].reset_index(drop=True)
+    i, j = find_pairs(by_length, directions=by_length['direction'], bounding_boxes=True, executor=executor)
+    kept, trip_sum = absorb_trip_counts(by_length, i, j)
+    state = pd.DataFrame({'component': pair_components(len(by_length), i, j), 'kept': kept, 'trip_sum': trip_sum},
+                         index=order)
+    return state.sort_index().reset_index(drop=True)
+
+
+def update_group_state(gdf, previous, dirty_shapes, kind, executor=None):
+    """
+    group_state of a vehicle group from the previous version's one, recomputing only the area
+    around changed segments: the components that held segments of dirty shapes, and those
+    within reach of the new segments. Components never interact, so the others are reused as they are.
+    """
+    keys = SEGMENT_KEYS + (['piece'] if kind == 'counts' else [])
+    columns = ['component'] + (['kept', 'trip_sum'] if kind == 'counts' else [])
+    if previous is None:
+        return group_state(gdf, kind, executor)
+
+    dirty = previous['shape_id'].isin(dirty_shapes)
+    state = gdf[keys].merge(previous.loc[~dirty, keys + columns], on=keys, how='left')[columns]
+    is_new = state['component'].isna().to_numpy()
+
+    affected = set(previous.loc[dirty, 'component'])
+    if is_new.any():
+        directions = gdf['direction'] if kind == 'counts' else None
+        _, j = parallel_pairs(gdf, directions=directions, bounding_boxes=kind == 'counts', rows=np.flatnonzero(is_new))
+        affected |= set(state['component'].to_numpy()[j[~is_new[j]]])
+
+    region = is_new | state['component'].isin(affected).to_numpy()
+    print(f"Recomputing {region.sum()} of {len(gdf)} segments")
+    if region.any():
+        region_state = group_state(gdf[region].reset_index(drop=True), kind, executor)
+        region_state['component'] += int(np.nan_to_num(state['component'].max(), nan=-1)) + 1
+        state.loc[region, columns] = region_state[columns].to_numpy()
+
+    state['component'] = state['component'].astype(np.int64)
+    if kind == 'counts':
+        state = state.astype({'kept': bool, 'trip_sum': float})
+    return state
+
+
+def group_corridors(gdf, state, kind):
+    """The stage-03 output of a vehicle group from its state, the same as aggregating it from scratch."""
+    helpers = [column for column in ['segment', 'piece'] + list(state.columns) if column in gdf]
+    gdf = gdf.drop(columns=helpers).reset_index(drop=True)
+    if kind == 'speeds':
+        return summarize_speed_clusters(gdf.drop(columns=['shape_id']), pd.factorize(state['component'])[0])
+
+    kept = state['kept'].to_numpy()
+    result = gdf.assign(trip_sum=state['trip_sum'].to_numpy())[kept]
+    result = result.iloc[longest_first(result['length'])]
+    return result[result['trip_sum'] > 0].reset_index(drop=True)
+
+
+# ---- Runner ----
+
+def number_segments(segments):
+    """Numbers the segments of every shape in order, to match them across versions."""
+    return segments.assign(segment=segments.groupby('shape_id', observed=True).cumcount().to_numpy())
+
+
+def run_incremental(city, kind='speeds', previous_folder=None, workers=None, **overrides):
+    """
+    Runs stages 01-03 for a city, reusing the outputs of the previous feed version for shapes
+    whose fingerprint did not change, and saves the state for the next version. Stage 02 is
+    only run for changed shapes, the others keep their segments at the exact lengths of the
+    previous run (coordinates moved below the fingerprints' rounding keep them too). Without a
+    previous state everything is processed (and the state saved). Returns a summary like
+    pipeline.run_city, with the number of changed shapes.
+    """
+    profile = city_profile(city, **overrides)
+    if profile['speed_bands']:
+        raise ValueError("Incremental runs do not support speed bands, segments are matched by shape and position only")
+    previous = load_state(previous_folder, profile, kind) if previous_folder else None
+    summary = {'city': city, 'kind': kind}
+
+    started = time.perf_counter()
+    if kind == 'speeds':
+        shapes, trips, stop_times = load_speed_inputs(profile)
+        stops = read_stops(profile) if profile['shape_distances'] == 'project' else None
+        fingerprints = speed_fingerprints(shapes, trips, stop_times, stops, load_frequencies(profile['folder_path']))
+    else:
+        counts = stage_01_counts(profile)
+        fingerprints = processed_fingerprints(counts)
+    dirty_shapes = changed_shapes(fingerprints, previous['fingerprints'] if previous else None)
+    summary['changed_shapes'] = len(dirty_shapes)
+    print(f"{len(dirty_shapes)} of {len(fingerprints)} shapes new, changed or removed")
+
+    if kind == 'speeds' and not dirty_shapes:
+        new_processed = previous['shapes_processed'].iloc[:0]
+    elif kind == 'speeds':
+        changed_trips = trips[trips['shape_id'].isin(dirty_shapes)]
+        new_processed, _ = compute_shape_speeds(profile, shapes[shapes['shape_id'].isin(dirty_shapes)], changed_trips,
+                                                stop_times[stop_times['trip_id'].isin(changed_trips['trip_id'])])
+    else:
+        new_processed = counts[counts['shape_id'].isin(dirty_shapes)]
+    reused = []
+    if previous:
+        reused = [previous['shapes_processed'][~previous['shapes_processed']['shape_id'].isin(dirty_shapes)]]
+    shapes_processed = pd.concat(reused + [new_processed], ignore_index=True)
+    summary['stage_01_s'], summary['stage_01_rows'] = time.perf_counter() - started, len(shapes_processed)
+
+    # Segments of unchanged shapes are reused with the exact lengths their group states were made with
+    started = time.perf_counter()
+    parts = []
+    if previous:
+        parts.append(previous['segments'][~previous['segments']['shape_id'].isin(dirty_shapes)])
+    if len(new_processed):
+        parts.append(number_segments(stage_02_segments(new_processed, profile, kind)))
+    segments = pd.concat(parts, ignore_index=True).sort_values(SEGMENT_KEYS, kind='stable').reset_index(drop=True)
+    segments = gpd.GeoDataFrame(segments, geometry='geometry', crs=profile['crs'])
+    segments['shape_id'] = segments['shape_id'].astype(str).astype('category')  # As in a full run
+    summary['stage_02_s'], summary['stage_02_rows'] = time.perf_counter() - started, len(segments)
+
+    started = time.perf_counter()
+    groups, corridors = {}, {}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    try:
+        for vehicle, gdf in corridor_groups(segments, kind).items():
+            gdf = gdf.reset_index(drop=True)
+            if kind == 'counts':
+                gdf['piece'] = gdf.groupby(SEGMENT_KEYS, observed=True).cumcount().to_numpy()
+            previous_group = previous['groups'].get(vehicle) if previous else None
+            state = update_group_state(gdf, previous_group, dirty_shapes, kind, executor)
+            corridors[vehicle] = group_corridors(gdf, state, kind)
+            groups[vehicle] = gdf.join(state)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    summary['stage_03_s'] = time.perf_counter() - started
+    summary['stage_03_rows'] = sum(len(gdf) for gdf in corridors.values())
+
+    save_corridors(corridors, profile, kind)
+    save_state(profile, kind, fingerprints, shapes_processed, segments, groups)
+    print(f"{city} {kind} (incremental): " + ", ".join(
+        f"stage {stage} {summary[f'stage_{stage}_rows']} rows in {summary[f'stage_{stage}_s']:.1f} s"
+        for stage in ('01', '02', '03')))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the pipeline for a new feed version, reusing the previous one.")
+    parser.add_argument('city', choices=sorted(CITY_PROFILES))
+    parser.add_argument('--kind', choices=KINDS, default='speeds')
+    parser.add_argument('--folder', help="Feed folder of the new version, instead of the profile's folder_path")
+    parser.add_argument('--previous', help="Feed folder of the previous version (processed with this script)")
+    parser.add_argument('--workers', type=int, help="Processes for the stage 03 spatial tiles")
+    args = parser.parse_args()
+
+    overrides = {'folder_path': args.folder} if args.folder else {}
+    run_incremental(args.city, args.kind, args.previous, args.workers, **overrides)
+
+
+if __name__ == "__main__":
+    main()
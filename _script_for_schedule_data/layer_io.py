@@ -0,0 +1,47 @@
+import os
+
+import geopandas as gpd
+
+# Formats stages 02 and 03 can write, by profile 'output_format': file extension and OGR driver
+# (None for GeoParquet, written by pyarrow). GeoParquet is the fastest to write and read back between
+# stages, FlatGeobuf carries a packed R-tree for viewers, shapefile is kept for older projects
+# (2 GB limit, field names cut to 10 characters, no spatial index).
+OUTPUT_FORMATS = {
+    'parquet': ('.parquet', None),
+    'fgb': ('.fgb', 'FlatGeobuf'),
+    'shapefile': ('.shp', 'ESRI Shapefile'),
+}
+
+
+def layer_path(folder_path, name, output_format):
+    """Path of the layer name (a file name without extension) in output_format."""
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}, expected one of {sorted(OUTPUT_FORMATS)}")
+    return os.path.join(folder_path, name + OUTPUT_FORMATS[output_format][0])
+
+
+def write_layer(gdf, folder_path, name, output_format='parquet'):
+    """
+    Writes a GeoDataFrame as the layer name in output_format and returns its path. GeoParquet gets
+    a bbox covering column, so readers can filter row groups by extent; FlatGeobuf and shapefiles
+    go through pyogrio with Arrow, FlatGeobuf with its spatial index. FlatGeobuf stores the features
+    in the order of that index, so segments read back from it can break stage 03 ties between
+    equally long segments differently; the corridors are otherwise the same.
+    """
+    path = layer_path(folder_path, name, output_format)
+    driver = OUTPUT_FORMATS[output_format][1]
+    if driver is None:
+        gdf.to_parquet(path, index=False, write_covering_bbox=True)
+    elif driver == 'FlatGeobuf':
+        gdf.to_file(path, driver=driver, engine='pyogrio', use_arrow=True, SPATIAL_INDEX='YES')
+    else:
+        gdf.to_file(path, driver=driver, engine='pyogrio', use_arrow=True)
+    return path
+
+
+def read_layer(folder_path, name, output_format='parquet'):
+    """The layer name written by write_layer in output_format."""
+    path = layer_path(folder_path, name, output_format)
+    if OUTPUT_FORMATS[output_format][1] is None:
+        return gpd.read_parquet(path)
+    return gpd.read_file(path, engine='pyogrio', use_arrow=True)
@@ -0,0 +1,98 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.ops import substring
+
+MONOTONIC_TOLERANCE = 1.0  # Meters a stop may fall behind the previous one before it is snapped again
+MAX_MONOTONIC_PASSES = 5
+
+
+def project_points(lon, lat, crs=None):
+    """
+    Projects WGS84 coordinates to a metric CRS, by default the UTM zone of the points.
+    Returns the x/y array and the CRS used.
+    """
+    points = gpd.GeoSeries(gpd.points_from_xy(lon, lat), crs="EPSG:4326")
+    if crs is None:
+        crs = points.estimate_utm_crs()
+    return shapely.get_coordinates(points.to_crs(crs).values), crs
+
+
+def add_shape_distances(shapes, crs=None):
+    """
+    Adds shape_dist_traveled (in kilometers, like the Warszawa feed) to shapes that lack it:
+    the cumulative length of each shape from its first point, computed in a metric CRS.
+    Returns the shapes sorted by shape_id and shape_pt_sequence, and the CRS used.
+    """
+    shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence']).reset_index(drop=True)
+    xy, crs = project_points(shapes['shape_pt_lon'], shapes['shape_pt_lat'], crs)
+
+    shape_ids = shapes['shape_id'].to_numpy()
+    step = np.concatenate([[0], np.hypot(*np.diff(xy, axis=0).T)])
+    step[np.concatenate([[True], shape_ids[1:] != shape_ids[:-1]])] = 0
+
+    shapes['shape_dist_traveled'] = shapes.assign(_step=step).groupby('shape_id', observed=True)['_step'].cumsum() / 1000
+    return shapes, crs
+
+
+def shape_lines(shapes, crs):
+    """One projected LineString per shape_id with at least two points, as (shape_ids, lines)."""
+    shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence'])
+    shapes = shapes[shapes.groupby('shape_id', observed=True)['shape_id'].transform('size') > 1]
+    xy, _ = project_points(shapes['shape_pt_lon'], shapes['shape_pt_lat'], crs)
+
+    shape_ids, codes = np.unique(shapes['shape_id'].to_numpy(), return_inverse=True)
+    return shape_ids, shapely.linestrings(xy, indices=codes)
+
+
+def _snap_after(lines, points, start):
+    """Locates each point on the part of its line beyond start (meters), for stops on loop routes."""
+    located = np.empty(len(lines))
+    for k, (line, point, offset) in enumerate(zip(lines, points, start)):
+        rest = substring(line, offset, line.length)
+        located[k] = offset + (rest.project(point) if rest.length > 0 else 0)
+    return located
+
+
+def locate_stops(stop_times, trips, stops, shapes, crs=None):
+    """
+    Sets shape_dist_traveled (in kilometers) of stop_times from their position along the trip's shape.
+    Every unique (shape_id, stop_id) pair is projected onto its shape line once and broadcast to
+    the stop_times. Where a stop lands behind the previous stop of its trip (loop routes passing
+    the same place twice), it is snapped again on the rest of the shape, so distances keep growing.
+    """
+    shape_ids, lines = shape_lines(shapes, crs)
+    stops = stops.drop_duplicates('stop_id').reset_index(drop=True)
+    stop_xy, _ = project_points(stops['stop_lon'], stops['stop_lat'], crs)
+    stop_points = shapely.points(stop_xy)
+
+    stop_times = stop_times.drop(columns=['shape_dist_traveled', 'shape_id'], errors='ignore')
+    stop_times = stop_times.merge(trips[['trip_id', 'shape_id']], on='trip_id', how='inner')
+    stop_times = stop_times[stop_times['shape_id'].isin(shape_ids) & stop_times['stop_id'].isin(stops['stop_id'])]
+
+    # Snap each (shape_id, stop_id) pair once
+    pairs = stop_times[['shape_id', 'stop_id']].drop_duplicates().reset_index(drop=True)
+    pairs['_line'] = np.searchsorted(shape_ids, pairs['shape_id'].to_numpy())
+    pairs['_stop'] = pd.Index(stops['stop_id']).get_indexer(pairs['stop_id'])
+    pairs['_dist'] = shapely.line_locate_point(lines[pairs['_line']], stop_points[pairs['_stop']])
+
+    stop_times = stop_times.merge(pairs, on=['shape_id', 'stop_id'], how='left')
+    stop_times = stop_times.sort_values(['trip_id', 'stop_sequence']).reset_index(drop=True)
+
+    # Keep distances monotonic along each trip
+    for _ in range(MAX_MONOTONIC_PASSES):
+        previous_max = stop_times.groupby('trip_id', observed=True)['_dist'].cummax().groupby(stop_times['trip_id'], observed=True).shift()
+        behind = (stop_times['_dist'] < previous_max - MONOTONIC_TOLERANCE).to_numpy()
+        if not behind.any():
+            break
+
+        fixes = stop_times.loc[behind, ['_line', '_stop']].assign(_start=previous_max[behind])
+        unique_fixes = fixes.drop_duplicates().reset_index(drop=True)
+        unique_fixes['_fixed'] = _snap_after(lines[unique_fixes['_line']], stop_points[unique_fixes['_stop']],
+                                             unique_fixes['_start'].to_numpy())
+        fixed = fixes.merge(unique_fixes, on=['_line', '_stop', '_start'], how='left')['_fixed']
+        stop_times.loc[behind, '_dist'] = fixed.to_numpy()
+
+    stop_times['shape_dist_traveled'] = stop_times['_dist'] / 1000
+    return stop_times.drop(columns=['_line', '_stop', '_dist'])
@@ -0,0 +1,284 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from city_profiles import city_profile, CITY_PROFILES
+from gtfs_feed import share_categories
+from gtfs_time import SECONDS_PER_DAY, assign_bands, speed_bands, window_labels
+from layer_io import OUTPUT_FORMATS
+from linear_ref import add_shape_distances, project_points, MAX_MONOTONIC_PASSES
+from pipeline import (read_shapes, read_trips, save_corridors, speed_windows, stage_02_segments, stage_03_corridors)
+from speeds import add_speed_sums, band_shape_speeds, shape_speeds_from_sums, speed_sums, valid_speeds
+
+BIN_LENGTH = 0.05  # Length (in kilometers) of the bins along a shape observed speeds are averaged in
+MAX_MATCH_DISTANCE = 30  # Positions farther (in meters) from their trip's shape are not matched
+BACKWARD_TOLERANCE = 0.02  # Kilometers a position may fall behind the previous one of its trip (GPS noise)
+MAX_OBSERVED_GAP = 120  # Seconds between two positions beyond which no speed is measured
+MATCH_BATCH_ROWS = 2_000_000  # Positions matched at once; batches end between trips
+SHAPE_SPACING = 1e7  # Meters every shape is moved apart in the index, so positions only meet segments of their own shape
+
+OBSERVED_PROCESSED = "observed_processed.csv"  # Like shapes_processed.csv, from the live positions
+
+
+def shape_index(shapes, crs):
+    """
+    Linear-referencing index of the shapes, built once for all positions: every two-point
+    segment of every shape with its start and end (projected meters), the shape_dist_traveled
+    (kilometers) at both ends and its shape, with an STRtree over the segments. In the tree the
+    segments of shape k are moved k * SHAPE_SPACING along x (see shape_space), so on streets
+    shared by many routes a query does not return the segments of all of them.
+    """
+    shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence']).dropna(subset=['shape_dist_traveled'])
+    xy, _ = project_points(shapes['shape_pt_lon'], shapes['shape_pt_lat'], crs)
+    shape_ids, codes = np.unique(shapes['shape_id'].to_numpy(), return_inverse=True)
+    dist = shapes['shape_dist_traveled'].to_numpy(dtype=np.float64)
+
+    segment = np.flatnonzero(codes[1:] == codes[:-1])
+    index = {
+        'shape_ids': pd.Index(shape_ids.astype(str)),
+        'shape': codes[segment],
+        'start': xy[segment], 'end': xy[segment + 1],
+        'start_dist': dist[segment], 'end_dist': dist[segment + 1],
+    }
+    start, end = shape_space(index['start'], index['shape']), shape_space(index['end'], index['shape'])
+    index['tree'] = shapely.STRtree(shapely.linestrings(np.stack([start, end], axis=1)))
+    return index
+
+
+def shape_space(xy, shape_codes):
+    """Projected points moved to the place of their shape in the index tree (see shape_index)."""
+    return xy + np.column_stack([shape_codes * SHAPE_SPACING, np.zeros(len(xy))])
+
+
+def read_positions(store_dir, dates=None):
+    """trip_id, timestamp (milliseconds, UTC), lat and lon of the live positions store, for its date partitions in dates."""
+    filters = [('date', 'in', list(dates))] if dates else None
+    positions = pd.read_parquet(store_dir, columns=['trip_id', 'timestamp', 'lat', 'lon'], filters=filters)
+    positions['timestamp'] = positions['timestamp'].dt.as_unit('ms').astype(np.int64)
+    positions['trip_id'] = positions['trip_id'].astype('category')
+    return positions
+
+
+def _nearest_candidates(candidates, n_points):
+    """Position in candidates of the nearest candidate of each of n_points positions, -1 for those without one."""
+    order = np.lexsort((candidates['offset'], candidates['point']))
+    first = order[np.concatenate([[True], np.diff(candidates['point'][order]) != 0])] if len(order) else order
+    nearest = np.full(n_points, -1)
+    nearest[candidates['point'][first]] = first
+    return nearest
+
+
+def locate_positions(xy, shape_codes, trip_codes, index, max_distance=MAX_MATCH_DISTANCE):
+    """
+    shape_dist_traveled (kilometers) of projected positions on the shapes of their trips, NaN
+    where a position is farther than max_distance from it. Positions must be sorted by trip and
+    time. Every position is projected onto all segments of its shape within max_distance and
+    takes the nearest. A position landing behind the previous one of its trip (loop routes
+    passing the same place twice) takes its nearest candidate ahead of it instead, or none; only
+    the previous position counts, so a single jump ahead loses no more than the position after it.
+    """
+    # Segments whose bounding box reaches max_distance around the position; distances are checked below
+    corner = shape_space(xy, shape_codes)
+    point, segment = index['tree'].query(shapely.box(*(corner - max_distance).T, *(corner + max_distance).T))
+
+    # Orthogonal projection onto the segment, clamped to its ends
+    start, step = index['start'][segment], index['end'][segment] - index['start'][segment]
+    to_point = xy[point] - start
+    length2 = (step ** 2).sum(axis=1)
+    ratio = np.clip(np.divide((to_point * step).sum(axis=1), length2, out=np.zeros(len(point)), where=length2 > 0), 0, 1)
+    offset = np.hypot(*(to_point - ratio[:, np.newaxis] * step).T)
+    near = offset <= max_distance
+    candidates = {
+        'point': point[near],
+        'offset': offset[near],
+        'dist': (index['start_dist'][segment] + ratio * (index['end_dist'][segment] - index['start_dist'][segment]))[near],
+    }
+
+    chosen = _nearest_candidates(candidates, len(xy))
+    dist = np.where(chosen >= 0, candidates['dist'][np.maximum(chosen, 0)], np.nan)
+    for _ in range(MAX_MONOTONIC_PASSES):
+        previous = pd.Series(dist).groupby(trip_codes).shift().to_numpy()
+        behind = dist < previous - BACKWARD_TOLERANCE
+        if not behind.any():
+            break
+        # Candidates of the positions behind that lie ahead of the previous position
+        ahead = behind[candidates['point']] & (candidates['dist'] >= previous[candidates['point']] - BACKWARD_TOLERANCE)
+        retry = {name: values[ahead] for name, values in candidates.items()}
+        nearest = _nearest_candidates(retry, len(xy))
+        dist[behind] = np.where(nearest[behind] >= 0, retry['dist'][np.maximum(nearest[behind], 0)], np.nan)
+    return dist
+
+
+def local_seconds(timestamp, timezone=None):
+    """Seconds since local midnight of timestamps (milliseconds, UTC) in timezone (UTC if None)."""
+    times = pd.DatetimeIndex(pd.to_datetime(timestamp, unit='ms', utc=True))
+    if timezone:
+        times = times.tz_convert(timezone)
+    return ((times - times.normalize()) // pd.Timedelta(seconds=1)).to_numpy() % SECONDS_PER_DAY
+
+
+def bin_stretches(stretches, bin_length=BIN_LENGTH):
+    """
+    Every stretch once per bin of bin_length kilometers it covers, its shape_dist_traveled replaced
+    by the middle of the bin, so stretches of any length add up in the same places.
+    """
+    first = np.floor(stretches['prev_dist'].to_numpy() / bin_length).astype(np.int64)
+    last = np.floor(stretches['shape_dist_traveled'].to_numpy() / bin_length).astype(np.int64)
+    bins = last - first + 1
+    rows = np.repeat(np.arange(len(stretches)), bins)
+    step = np.arange(len(rows)) - np.repeat(np.cumsum(bins) - bins, bins)
+    return stretches.iloc[rows].assign(shape_dist_traveled=(first[rows] + step + 0.5) * bin_length)
+
+
+def observed_stretches(positions, dist, timezone=None, max_gap=MAX_OBSERVED_GAP):
+    """
+    Speeds (km/h) along the shape between consecutive matched positions of every trip, as
+    stretches with trip_id, prev_dist and shape_dist_traveled (kilometers), prev_departure_time
+    (local seconds of day, when the stretch starts) and speed. Stretches over longer gaps
+    than max_gap, or with speeds outside MIN_SPEED and MAX_SPEED, are dropped.
+    """
+    matched = ~np.isnan(dist)
+    positions, dist = positions[matched], dist[matched]
+    trips = positions['trip_id'].cat.codes.to_numpy()
+    timestamp = positions['timestamp'].to_numpy()
+
+    same_trip = trips[1:] == trips[:-1]
+    time_diff = np.diff(timestamp) / 1000
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = np.diff(dist) / time_diff * 3600
+    valid = np.flatnonzero(same_trip & (time_diff > 0) & (time_diff <= max_gap) & valid_speeds(speed))
+    return pd.DataFrame({
+        'trip_id': positions['trip_id'].iloc[valid + 1].reset_index(drop=True),
+        'prev_dist': dist[valid],
+        'shape_dist_traveled': dist[valid + 1],
+        'prev_departure_time': local_seconds(timestamp[valid], timezone),
+        'speed': speed[valid],
+    })
+
+
+def _batches(trip_codes, batch_rows):
+    """(start, end) row ranges of about batch_rows rows of trip-sorted positions, cut between trips."""
+    cuts = np.flatnonzero(np.diff(trip_codes) != 0) + 1
+    edges = [0]
+    while len(trip_codes) - edges[-1] > batch_rows:
+        after = cuts[cuts >= edges[-1] + batch_rows]
+        if not len(after):
+            break
+        edges.append(after[0])
+    return list(zip(edges, edges[1:] + [len(trip_codes)]))
+
+
+def stage_01_observed(profile, store_dir, dates=None, batch_rows=MATCH_BATCH_ROWS):
+    """
+    Stage 01 for observed speeds: live positions (see _script_for_live_data/live_positions.py)
+    matched onto the shapes of their trips (trip_ids of the feed) and measured along them, as
+    shape points with the average observed 'speed' of the bins around them, like stage_01_speeds
+    makes from the schedule, so stage 02 turns them into segments the same way. The profile's
+    speed bands, or else its windows, apply to the stretches by the local time (in its timezone)
+    they start at.
+    """
+    shapes = read_shapes(profile)
+    trips = read_trips(profile)
+    share_categories([shapes, trips], 'shape_id')
+    if profile['shape_distances'] == 'project':
+        shapes, _ = add_shape_distances(shapes)
+    index = shape_index(shapes, profile['crs'])
+
+    # Shape of every position, looked up once per trip_id
+    positions = read_positions(store_dir, dates)
+    feed_trips = trips.drop_duplicates('trip_id')
+    trip_shapes = pd.Series(feed_trips['shape_id'].astype(str).to_numpy(), index=feed_trips['trip_id'].astype(str).to_numpy())
+    category_shape = index['shape_ids'].get_indexer(trip_shapes.reindex(positions['trip_id'].cat.categories.astype(str)).astype(str))
+    codes = positions['trip_id'].cat.codes.to_numpy()
+    shape_codes = np.where(codes >= 0, category_shape[codes], -1)
+    known = shape_codes >= 0
+    print(f"{known.sum()} of {len(positions)} positions belong to trips of the feed")
+    positions, shape_codes = positions[known], shape_codes[known]
+    # The trips' categories let speed_sums merge on codes
+    positions['trip_id'] = positions['trip_id'].astype(trips['trip_id'].dtype)
+
+    order = np.lexsort((positions['timestamp'].to_numpy(), positions['trip_id'].cat.codes.to_numpy()))
+    positions, shape_codes = positions.iloc[order].reset_index(drop=True), shape_codes[order]
+    xy, _ = project_points(positions['lon'], positions['lat'], profile['crs'])
+    trip_codes = positions['trip_id'].cat.codes.to_numpy()
+
+    windows = speed_windows(profile)
+    bands = speed_bands(profile['speed_bands']) if profile['speed_bands'] else None
+    sums, matched = [], 0
+    for start, end in _batches(trip_codes, batch_rows):
+        dist = locate_positions(xy[start:end], shape_codes[start:end], trip_codes[start:end], index)
+        matched += np.count_nonzero(~np.isnan(dist))
+        stretches = observed_stretches(positions.iloc[start:end], dist, profile['timezone'])
+        if bands is not None:
+            stretches = assign_bands(stretches, bands)
+        elif windows is not None:
+            stretches = stretches[window_labels(stretches['prev_departure_time'].to_numpy(), windows) >= 0]
+        sums.append(speed_sums(bin_stretches(stretches), trips))
+    print(f"Matched {matched} positions to their shapes")
+
+    sums = add_speed_sums(sums)
+    if bands is not None:
+        return band_shape_speeds(shapes, sums, matching='nearest')
+    return shape_speeds_from_sums(shapes, sums, matching='nearest')
+
+
+def save_observed_processed(observed_processed, profile):
+    observed_processed.to_csv(os.path.join(profile['folder_path'], OBSERVED_PROCESSED), index=False)
+
+
+def load_observed_processed(profile):
+    return pd.read_csv(os.path.join(profile['folder_path'], OBSERVED_PROCESSED), dtype={'shape_id': str})
+
+
+def run_observed(city, store_dir, dates=None, save_intermediate=False, workers=None, **overrides):
+    """Runs stage 01 for observed speeds and stages 02 and 03 on it, like pipeline.run_city; returns the timings."""
+    profile = city_profile(city, **overrides)
+    summary = {'city': city, 'kind': 'observed'}
+
+    started = time.perf_counter()
+    observed_processed = stage_01_observed(profile, store_dir, dates)
+    summary['stage_01_s'], summary['stage_01_rows'] = time.perf_counter() - started, len(observed_processed)
+
+    started = time.perf_counter()
+    segments = stage_02_segments(observed_processed, profile, 'speeds')
+    summary['stage_02_s'], summary['stage_02_rows'] = time.perf_counter() - started, len(segments)
+
+    started = time.perf_counter()
+    corridors = stage_03_corridors(segments, 'speeds', workers)
+    summary['stage_03_s'] = time.perf_counter() - started
+    summary['stage_03_rows'] = sum(len(gdf) for gdf in corridors.values())
+
+    if save_intermediate:
+        save_observed_processed(observed_processed, profile)
+    save_corridors(corridors, profile, 'observed')
+
+    print(f"{city} observed: " + ", ".join(
+        f"stage {stage} {summary[f'stage_{stage}_rows']} rows in {summary[f'stage_{stage}_s']:.1f} s"
+        for stage in ('01', '02', '03')))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matches live positions onto a city's shapes and runs stages 02-03 on their speeds.")
+    parser.add_argument('city', choices=sorted(CITY_PROFILES))
+    parser.add_argument('store', help="Positions store written by _script_for_live_data/01_parseJSONtoCSV.py")
+    parser.add_argument('--date', action='append', help="Date partition (YYYY-MM-DD) to match, repeatable; all by default")
+    parser.add_argument('--folder', help="Feed folder, instead of the profile's folder_path")
+    parser.add_argument('--save-intermediate', action='store_true', help="Also write observed_processed.csv")
+    parser.add_argument('--workers', type=int, help="Processes for the stage 03 corridor aggregation")
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_FORMATS),
+                        help="Format of the segment and corridor layers, instead of the profile's output_format")
+    args = parser.parse_args()
+
+    overrides = {'folder_path': args.folder} if args.folder else {}
+    if args.output_format:
+        overrides['output_format'] = args.output_format
+    run_observed(args.city, args.store, args.date, args.save_intermediate, args.workers, **overrides)
+
+
+if __name__ == "__main__":
+    main()
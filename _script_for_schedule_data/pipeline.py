@@ -0,0 +1,448 @@
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import pandas as pd
+
+from city_profiles import city_profile, CITY_PROFILES
+from corridors import aggregate_speeds, aggregate_trip_counts, MIN_TILED_SEGMENTS
+from frequencies import (load_frequencies, frequency_trip_ids, trip_spans, virtual_trip_counts, trip_weights,
+                         weigh_virtual_trips)
+from gtfs_feed import (iter_feed_table, read_feed_table, compact_distances, compact_ids, share_categories,
+                       CHUNK_SIZE, TRIPS_USECOLS, STOP_TIMES_USECOLS, STOPS_USECOLS)
+from gtfs_time import parse_stop_times, trip_windows, assign_bands, speed_bands
+from layer_io import read_layer, write_layer, OUTPUT_FORMATS
+from linear_ref import add_shape_distances, locate_stops
+from segments import build_segments, split_lines
+from service_calendar import resolve_service
+from speeds import (calculate_speeds, speed_sums, add_speed_sums, shape_speeds_from_sums, band_shape_speeds, speed_cube,
+                    dwell_sums, add_dwell_sums, dwell_stats, RUNNING_SPEED, DELTA_LAYERS)
+from stop_times_cache import load_cached_stop_times
+from stop_times_spill import spill_partitions, read_partition, SPILL_PREFIX
+from vehicles import assign_vehicles
+
+KINDS = ('speeds', 'counts')
+SEGMENT_LENGTH = 10  # Length (in meters) count lines are split into before aggregating
+MIN_SPEED_SEGMENT_LENGTH = 10  # Shorter speed segments are left out of the corridors
+
+# Outputs of the stages, written next to the feed; layers of stages 02 and 03 get the extension of
+# the profile's output_format (see layer_io.OUTPUT_FORMATS)
+SHAPES_PROCESSED = "shapes_processed.csv"
+STAGE_01_OUTPUTS = {'stop_dwell': "stop_dwell.csv", 'speed_cube': "speed_cube.csv"}  # Written when the profile asks
+SEGMENT_FILES = {'speeds': "speed_processed_to_lines", 'counts': "individual_segments",
+                 'delta': "speed_delta_to_lines"}
+CORRIDOR_FILES = {'speeds': "average_speed_segments_{vehicle}", 'counts': "aggregated_segments_{vehicle}",
+                  'observed': "observed_speed_segments_{vehicle}",  # observed: see observed_speeds.py
+                  'delta': "speed_delta_segments_{vehicle}"}  # delta: see speed_delta.py
+
+
+def time_mode(profile, kind='speeds'):
+    """The profile's time_mode for kind, count_time_mode for counts when it is set."""
+    if kind == 'counts' and profile['count_time_mode'] is not None:
+        return profile['count_time_mode']
+    return profile['time_mode']
+
+
+def parse_stop_times_chunk(chunk, profile, kind='speeds'):
+    """Compacts and parses a chunk of stop_times.txt: categorical ids, int32 times, float32 distances in kilometers."""
+    chunk = compact_ids(compact_distances(chunk, profile['distance_factor']))
+    return parse_stop_times(chunk, mode=time_mode(profile, kind))
+
+
+def read_stop_times(profile, kind='speeds'):
+    """Parsed stop_times of the profile's feed, from the columnar cache (rebuilt when stop_times.txt changes)."""
+    folder_path = profile['folder_path']
+
+    def build():
+        return read_feed_table(folder_path, "stop_times.txt", usecols=STOP_TIMES_USECOLS,
+                               dtype={'trip_id': str, 'stop_id': str},
+                               transform=lambda chunk: parse_stop_times_chunk(chunk, profile, kind))
+
+    return load_cached_stop_times(folder_path, build, key=f"{time_mode(profile, kind)},{profile['distance_factor']}")
+
+
+def iter_stop_times(profile, chunksize=CHUNK_SIZE):
+    """Parsed stop_times of the profile's feed, chunk by chunk, straight from the feed (no cache)."""
+    for chunk in iter_feed_table(profile['folder_path'], "stop_times.txt", usecols=STOP_TIMES_USECOLS,
+                                 dtype={'trip_id': str, 'stop_id': str}, chunksize=chunksize):
+        yield parse_stop_times_chunk(chunk, profile)
+
+
+def read_trips(profile):
+    """Trips of the profile's feed with their 'vehicle' type, ids as categoricals."""
+    folder_path = profile['folder_path']
+    trips = read_feed_table(folder_path, "trips.txt", usecols=TRIPS_USECOLS,
+                            dtype={'route_id': str, 'service_id': str, 'trip_id': str, 'shape_id': str})
+    if profile['shape_id_separator']:
+        trips['shape_id'] = trips['shape_id'].str.split(profile['shape_id_separator']).str[0]
+
+    routes = None
+    if profile['vehicle_type'] == 'route_type':
+        routes = read_feed_table(folder_path, "routes.txt", usecols=['route_id', 'route_type'], dtype={'route_id': str})
+    return compact_ids(assign_vehicles(trips, profile['vehicle_type'], routes))
+
+
+def read_shapes(profile):
+    """Shapes of the profile's feed, shape_id as a categorical and shape_dist_traveled in kilometers (float32)."""
+    factor = profile['distance_factor']
+    return read_feed_table(profile['folder_path'], "shapes.txt", dtype={'shape_id': str},
+                           transform=lambda chunk: compact_ids(compact_distances(chunk, factor)))
+
+
+def select_service_trips(trips, profile):
+    """
+    Keeps the trips of the day the profile counts (its 'service' setting). With ('date', dates)
+    the feed's calendar decides (see service_calendar); for several dates a trip is kept once
+    per date it runs, so counts add up over the dates.
+    """
+    if profile['service'] is None:
+        return trips
+
+    method, value = profile['service']
+    if method == 'date':
+        pairs = resolve_service(profile['folder_path'], trips, value, profile['service_id_separator'])
+        print(f"Found {len(pairs)} trips running on {value}")
+        return trips.loc[pairs.index]
+    if method == 'calendar_start_date':
+        # Service ids of trips end with the calendar service after a colon, e.g. '...:5_2'
+        calendar = read_feed_table(profile['folder_path'], "calendar.txt", dtype={'service_id': str})
+        calendar_service = calendar[calendar['start_date'] == int(value)]['service_id'].iloc[0]
+        print(f"Found calendar service for {value}: {calendar_service}")
+        return trips[trips['service_id'].str.split(':').str[1] == calendar_service]
+    if method == 'trip_id_contains':
+        return trips[trips['trip_id'].str.contains(value, regex=False)]
+    raise ValueError(f"Unknown service selection {method!r}")
+
+
+def filter_trips_in_windows(trips, stop_times, windows, keep=None):
+    """
+    Keeps trips (and their stop_times) with at least one stop time within the windows, and the
+    trip_ids of keep whatever their times (frequency-based trips, whose virtual trips are counted instead).
+    """
+    if windows is None:
+        return trips, stop_times
+    valid_trips = trip_windows(stop_times, windows)['trip_id'].unique()
+    if keep is None:
+        return trips[trips['trip_id'].isin(valid_trips)], stop_times[stop_times['trip_id'].isin(valid_trips)]
+    return (trips[trips['trip_id'].isin(valid_trips) | trips['trip_id'].isin(keep)],
+            stop_times[stop_times['trip_id'].isin(valid_trips) | stop_times['trip_id'].isin(keep)])
+
+
+def load_speed_inputs(profile):
+    """Shapes, trips and parsed stop_times of the profile's feed, limited to trips within its windows."""
+    shapes = read_shapes(profile)
+    trips = read_trips(profile)
+    stop_times = read_stop_times(profile)
+    # The same categories on both sides let merges compare codes
+    share_categories([shapes, trips], 'shape_id')
+    share_categories([trips, stop_times], 'trip_id')
+    trips = speed_service_trips(trips, profile)
+    trips, stop_times = filter_trips_in_windows(trips, stop_times, speed_windows(profile),
+                                                keep=frequency_trip_ids(load_frequencies(profile['folder_path'])))
+    return shapes, trips, stop_times
+
+
+def speed_service_trips(trips, profile):
+    """The trips speeds are measured on: those of the profile's service with speed_service, otherwise all."""
+    return select_service_trips(trips, profile) if profile['speed_service'] else trips
+
+
+def speed_windows(profile):
+    """Windows trips must touch to be used for speeds; none with speed bands, which cover the whole day by themselves."""
+    return None if profile['speed_bands'] else profile['windows']
+
+
+def read_stops(profile):
+    return read_feed_table(profile['folder_path'], "stops.txt", usecols=STOPS_USECOLS, dtype={'stop_id': str})
+
+
+def measure_speeds(profile, shapes, trips, stop_times, stops=None, crs=None):
+    """
+    speed_sums of the trips of stop_times. With projected shape distances, shapes must already
+    have them (see add_shape_distances, which gives crs) and stops are projected onto the shapes.
+    With speed bands, the sums are split by the band each stretch starts in. The stretches of
+    frequency-based trips count once per virtual trip (see frequencies.weigh_virtual_trips).
+    Returns the sums, the dwell_sums of the stops (None unless the profile asks for running
+    speeds) and the number of stretches the speeds were measured on.
+    """
+    dwell = dwell_sums(stop_times) if profile['running_speed'] else None
+    frequencies = load_frequencies(profile['folder_path'])
+    spans = trip_spans(stop_times, frequencies) if frequencies is not None else None
+    if profile['shape_distances'] == 'project':
+        # Project every stop onto its trip's shape to get shape_dist_traveled
+        stop_times = locate_stops(stop_times, trips, stops, shapes, crs)
+
+    stop_times = calculate_speeds(stop_times, running=profile['running_speed'])
+    bands = speed_bands(profile['speed_bands']) if profile['speed_bands'] else None
+    if frequencies is not None:
+        stop_times = weigh_virtual_trips(stop_times, frequencies, spans, speed_windows(profile), bands, profile['time_mode'])
+    elif bands is not None:
+        stop_times = assign_bands(stop_times, bands)
+    return speed_sums(stop_times, trips), dwell, len(stop_times)
+
+
+def finish_shape_speeds(profile, shapes, sums, dwell):
+    """
+    The shape points with their speeds from the speed_sums of all trips (stacked per band with
+    speed bands), and the optional stage 01 outputs of the profile, by STAGE_01_OUTPUTS name:
+    stop_dwell with running speeds, speed_cube with speed bands.
+    """
+    outputs = {}
+    if dwell is not None:
+        outputs['stop_dwell'] = dwell_stats(dwell)
+    if profile['speed_bands']:
+        outputs['speed_cube'] = speed_cube(sums)
+        return band_shape_speeds(shapes, sums, matching=profile['speed_matching']), outputs
+    return shape_speeds_from_sums(shapes, sums, matching=profile['speed_matching']), outputs
+
+
+def compute_shape_speeds(profile, shapes, trips, stop_times):
+    """
+    Stage 01 for speeds on loaded inputs; every shape is computed independently of the others.
+    Returns the shape points with their speeds and the optional outputs (see finish_shape_speeds).
+    """
+    stops, crs = None, None
+    if profile['shape_distances'] == 'project':
+        shapes, crs = add_shape_distances(shapes)
+        stops = read_stops(profile)
+
+    sums, dwell, records = measure_speeds(profile, shapes, trips, stop_times, stops, crs)
+    print(f"Number of records after calculating differences: {records}")
+    return finish_shape_speeds(profile, shapes, sums, dwell)
+
+
+def stage_01_speeds(profile):
+    """
+    Stage 01 for speeds: shape points with the average speed of the trips passing them
+    ('speed', arrival to arrival, and with the profile's running_speed also RUNNING_SPEED,
+    departure to arrival), and the optional outputs (see finish_shape_speeds).
+    """
+    return compute_shape_speeds(profile, *load_speed_inputs(profile))
+
+
+def stage_01_speeds_partitioned(profile, partitions, spill_root=None, chunksize=CHUNK_SIZE):
+    """
+    stage_01_speeds for feeds whose stop_times do not fit in memory. stop_times are streamed in
+    chunks and spilled to temporary files (in spill_root, by default the system temp folder),
+    partitioned by the hash of trip_id. The partitions are then processed one at a time and their
+    speed_sums added up, so memory is bounded by a chunk and a partition rather than the feed.
+    The result is the same as stage_01_speeds.
+    """
+    shapes = read_shapes(profile)
+    trips = read_trips(profile)
+    share_categories([shapes, trips], 'shape_id')
+    trips = speed_service_trips(trips, profile)
+    stops, crs = None, None
+    if profile['shape_distances'] == 'project':
+        shapes, crs = add_shape_distances(shapes)
+        stops = read_stops(profile)
+
+    templates = frequency_trip_ids(load_frequencies(profile['folder_path']))
+    sums, dwell, records = None, None, 0
+    with tempfile.TemporaryDirectory(prefix=SPILL_PREFIX, dir=spill_root) as spill_dir:
+        rows = spill_partitions(iter_stop_times(profile, chunksize), spill_dir, partitions)
+        print(f"Spilled {rows.sum()} stop_times into {partitions} partitions of at most {rows.max()} rows")
+
+        for partition in range(partitions):
+            stop_times = read_partition(spill_dir, partition)
+            if stop_times is None:
+                continue
+            share_categories([trips, stop_times], 'trip_id')
+            partition_trips, stop_times = filter_trips_in_windows(trips, stop_times, speed_windows(profile), keep=templates)
+            partition_sums, partition_dwell, partition_records = measure_speeds(
+                profile, shapes, partition_trips, stop_times, stops, crs)
+            sums = partition_sums if sums is None else add_speed_sums([sums, partition_sums])
+            if partition_dwell is not None:
+                dwell = partition_dwell if dwell is None else add_dwell_sums([dwell, partition_dwell])
+            records += partition_records
+
+    if sums is None:
+        raise ValueError(f"No stop_times in {profile['folder_path']}")
+    print(f"Number of records after calculating differences: {records}")
+    return finish_shape_speeds(profile, shapes, sums, dwell)
+
+
+def stage_01_counts(profile):
+    """
+    Stage 01 for counts: shape points with the number of trips of the counted day along the shape.
+    A frequency-based trip counts as many times as its virtual trips run (within count_windows).
+    """
+    shapes = read_shapes(profile)
+    trips = read_trips(profile)
+    share_categories([shapes, trips], 'shape_id')
+    trips = select_service_trips(trips, profile)
+    frequencies = load_frequencies(profile['folder_path'])
+    windows, spans = profile['count_windows'], None
+    if windows is not None:
+        stop_times = read_stop_times(profile, 'counts')
+        trips, _ = filter_trips_in_windows(trips, stop_times, windows, keep=frequency_trip_ids(frequencies))
+        spans = trip_spans(stop_times, frequencies) if frequencies is not None else None
+    trips = trips.assign(trip_count=1)
+    if frequencies is not None:
+        counts = virtual_trip_counts(frequencies, windows, spans, time_mode(profile, 'counts'))
+        trips['trip_count'] = trip_weights(trips['trip_id'], counts)
+
+    trip_counts = trips.groupby('shape_id', observed=True).agg(trip_count=('trip_count', 'sum'), vehicle=('vehicle', 'first'))
+    shapes = pd.merge(shapes, trip_counts.reset_index(), on='shape_id', how='left')
+    shapes['trip_count'] = shapes['trip_count'].fillna(0)
+    return shapes
+
+
+def stage_02_segments(shapes_processed, profile, kind='speeds'):
+    """Stage 02: two-point segments between consecutive shape points, in the profile's metric CRS."""
+    gdf = gpd.GeoDataFrame(
+        shapes_processed,
+        geometry=gpd.points_from_xy(shapes_processed['shape_pt_lon'], shapes_processed['shape_pt_lat']),
+        crs="EPSG:4326"
+    ).to_crs(profile['crs'])
+    gdf = gdf.sort_values(['shape_id', 'shape_pt_sequence'])
+
+    if kind == 'counts':
+        return build_segments(gdf, attributes=['trip_count', 'vehicle'], attributes_from='start')
+
+    # Speed of the stretch reaching a point, offset 10 m to the right of the direction of travel
+    attributes = ['vehicle', 'speed'] + [layer for layer in [RUNNING_SPEED] + DELTA_LAYERS if layer in gdf]
+    if 'band' not in gdf:
+        return build_segments(gdf, attributes=attributes, offset=10)
+    # One layer of segments per speed band, told apart by their 'band'
+    return pd.concat([build_segments(band_points, attributes=attributes, offset=10).assign(band=band)
+                      for band, band_points in gdf.groupby('band', sort=False)], ignore_index=True)
+
+
+def corridor_groups(segments, kind='speeds'):
+    """
+    The segments stage 03 aggregates, by vehicle (by band and vehicle, as '{band}_{vehicle}', with
+    speed bands): speed segments over 10 m, count segments split into 10 m pieces.
+    """
+    if kind == 'speeds':
+        filtered = segments[(segments['length'] > MIN_SPEED_SEGMENT_LENGTH) & (segments['vehicle'] != 'Unknown')]
+    else:
+        filtered = segments[(segments['trip_count'] > 0) & (segments['length'] > 0) & (segments['vehicle'] != 'Unknown')]
+        filtered = split_lines(filtered, SEGMENT_LENGTH)
+    if 'band' in filtered:
+        return {f"{band}_{vehicle}": df for (band, vehicle), df in filtered.groupby(['band', 'vehicle'], sort=False)}
+    return dict(tuple(filtered.groupby('vehicle')))
+
+
+def stage_03_corridors(segments, kind='speeds', workers=None):
+    """
+    Stage 03: segments of all shapes merged into corridors, as {vehicle: GeoDataFrame} sorted by vehicle.
+    With workers > 1 the vehicle groups run in a process pool, and groups of at least
+    MIN_TILED_SEGMENTS segments are split into spatial tiles on the same pool (see corridors.find_pairs).
+    The corridors are the same as with a single process.
+    """
+    groups = corridor_groups(segments, kind)
+    if kind == 'speeds':
+        groups = {vehicle: df.drop(columns=['shape_id']) for vehicle, df in groups.items()}
+    aggregate = aggregate_speeds if kind == 'speeds' else aggregate_trip_counts
+
+    if not workers or workers < 2 or not groups:
+        return {vehicle: aggregate(df) for vehicle, df in groups.items()}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Small groups run whole in a worker; large ones are tiled from here, on the same pool
+        futures = {vehicle: executor.submit(aggregate, df)
+                   for vehicle, df in groups.items() if len(df) < MIN_TILED_SEGMENTS}
+        corridors = {vehicle: aggregate(df, executor=executor)
+                     for vehicle, df in groups.items() if len(df) >= MIN_TILED_SEGMENTS}
+        corridors.update({vehicle: future.result() for vehicle, future in futures.items()})
+    return dict(sorted(corridors.items()))
+
+
+def save_shapes_processed(shapes_processed, profile):
+    shapes_processed.to_csv(os.path.join(profile['folder_path'], SHAPES_PROCESSED), index=False)
+
+
+def save_stage_01_outputs(outputs, profile):
+    for name, df in outputs.items():
+        df.to_csv(os.path.join(profile['folder_path'], STAGE_01_OUTPUTS[name]), index=False)
+
+
+def load_shapes_processed(profile):
+    return pd.read_csv(os.path.join(profile['folder_path'], SHAPES_PROCESSED), dtype={'shape_id': str})
+
+
+def save_segments(segments, profile, kind='speeds'):
+    write_layer(segments, profile['folder_path'], SEGMENT_FILES[kind], profile['output_format'])
+
+
+def load_segments(profile, kind='speeds'):
+    return read_layer(profile['folder_path'], SEGMENT_FILES[kind], profile['output_format']).to_crs(profile['crs'])
+
+
+def save_corridors(corridors, profile, kind='speeds'):
+    for vehicle, gdf in corridors.items():
+        if gdf.empty:
+            print(f"No corridor segments found for {vehicle}")
+            continue
+        write_layer(gdf, profile['folder_path'], CORRIDOR_FILES[kind].format(vehicle=vehicle), profile['output_format'])
+        print(f"Saved {len(gdf)} corridor segments for {vehicle}")
+
+
+def run_city(city, kind='speeds', save_intermediate=False, workers=None, partitions=None, **overrides):
+    """
+    Runs stages 01, 02 and 03 for a city in one process, passing the DataFrames between stages
+    in memory. Only the corridors are written, unless save_intermediate also asks for
+    shapes_processed.csv and the segments layer. workers parallelizes stage 03; partitions
+    runs stage 01 for speeds out of core (see stage_01_speeds_partitioned).
+    Returns the timing and row count of every stage.
+    """
+    profile = city_profile(city, **overrides)
+    summary = {'city': city, 'kind': kind}
+
+    started = time.perf_counter()
+    outputs = {}
+    if kind == 'counts':
+        shapes_processed = stage_01_counts(profile)
+    elif partitions:
+        shapes_processed, outputs = stage_01_speeds_partitioned(profile, partitions)
+    else:
+        shapes_processed, outputs = stage_01_speeds(profile)
+    summary['stage_01_s'], summary['stage_01_rows'] = time.perf_counter() - started, len(shapes_processed)
+
+    started = time.perf_counter()
+    segments = stage_02_segments(shapes_processed, profile, kind)
+    summary['stage_02_s'], summary['stage_02_rows'] = time.perf_counter() - started, len(segments)
+
+    started = time.perf_counter()
+    corridors = stage_03_corridors(segments, kind, workers)
+    summary['stage_03_s'] = time.perf_counter() - started
+    summary['stage_03_rows'] = sum(len(gdf) for gdf in corridors.values())
+
+    if save_intermediate:
+        save_shapes_processed(shapes_processed, profile)
+        save_segments(segments, profile, kind)
+    save_stage_01_outputs(outputs, profile)
+    save_corridors(corridors, profile, kind)
+
+    print(f"{city} {kind}: " + ", ".join(
+        f"stage {stage} {summary[f'stage_{stage}_rows']} rows in {summary[f'stage_{stage}_s']:.1f} s"
+        for stage in ('01', '02', '03')))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the schedule data pipeline (stages 01-03) for a city.")
+    parser.add_argument('city', choices=sorted(CITY_PROFILES))
+    parser.add_argument('--kind', choices=KINDS, default='speeds')
+    parser.add_argument('--folder', help="Feed folder, instead of the profile's folder_path")
+    parser.add_argument('--save-intermediate', action='store_true',
+                        help="Also write shapes_processed.csv and the segments layer")
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_FORMATS),
+                        help="Format of the segment and corridor layers, instead of the profile's output_format")
+    parser.add_argument('--workers', type=int, help="Processes for the stage 03 corridor aggregation")
+    parser.add_argument('--partitions', type=int,
+                        help="Stream stop_times through this many spill partitions (speeds of feeds too large for memory)")
+    args = parser.parse_args()
+
+    overrides = {'folder_path': args.folder} if args.folder else {}
+    if args.output_format:
+        overrides['output_format'] = args.output_format
+    run_city(args.city, args.kind, args.save_intermediate, args.workers, args.partitions, **overrides)
+
+
+if __name__ == "__main__":
+    main()
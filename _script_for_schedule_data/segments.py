@@ -0,0 +1,102 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+
+def segment_directions(dx, dy):
+    """Azimuth of segments with the given coordinate deltas, in degrees within [0, 360)."""
+    return np.degrees(np.arctan2(dy, dx)) % 360
+
+
+def build_segments(points, attributes=(), attributes_from='end', offset=None, group_col='shape_id'):
+    """
+    Builds one two-point LineString per pair of consecutive points of the same shape, all at once.
+    points must be a GeoDataFrame of points in a metric CRS, sorted by group_col and shape_pt_sequence.
+    attributes are copied from the pair's 'end' point (speed of the stretch reaching it) or 'start' point.
+    offset moves every segment sideways by that many meters to the right of its direction of travel,
+    so both directions of a street stay apart.
+    Returns a GeoDataFrame with group_col, the attributes, length and direction (degrees).
+    """
+    coords = shapely.get_coordinates(points.geometry.values)
+    groups = pd.factorize(points[group_col])[0]
+
+    # A pair is a segment when both points belong to the same shape
+    start = np.flatnonzero(groups[1:] == groups[:-1])
+    end = start + 1
+
+    dx = coords[end, 0] - coords[start, 0]
+    dy = coords[end, 1] - coords[start, 1]
+    line_coords = np.stack([coords[start], coords[end]], axis=1)
+
+    if offset:
+        perp_azimuth = np.arctan2(dy, dx) - np.pi / 2
+        shift = np.column_stack([offset * np.cos(perp_azimuth), offset * np.sin(perp_azimuth)])
+        line_coords = line_coords + shift[:, np.newaxis, :]
+
+    source = end if attributes_from == 'end' else start
+    # Selected with iloc, so categorical columns stay categorical
+    columns = {group_col: points[group_col].iloc[start].array}
+    for attribute in attributes:
+        columns[attribute] = points[attribute].iloc[source].array
+    columns['length'] = np.hypot(dx, dy)
+    columns['direction'] = segment_directions(dx, dy)
+
+    return gpd.GeoDataFrame(columns, geometry=shapely.linestrings(line_coords), crs=points.crs)
+
+
+def split_lines(gdf, segment_length):
+    """
+    Splits every line into round(length / segment_length) (at least 1) equal pieces, all at once.
+    Split points are interpolated along the cumulative vertex distances of each line, the pieces are
+    created in bulk and the parent rows' attributes are repeated by index. length and direction are
+    recalculated for the pieces.
+    """
+    if gdf.empty:
+        return gdf.copy()
+    geometries = gdf.geometry.values
+    coords, line_index = shapely.get_coordinates(geometries, return_index=True)
+    n_lines = len(gdf)
+
+    # Distance of every vertex from the start of its own line, so a line's pieces do not depend on the others
+    step = np.hypot(*np.diff(coords, axis=0).T)
+    step = np.concatenate([[0], np.where(line_index[1:] != line_index[:-1], 0, step)])
+    vertex_dist = pd.Series(step).groupby(line_index).cumsum().to_numpy()
+    first_vertex = np.searchsorted(line_index, np.arange(n_lines))
+    last_vertex = np.searchsorted(line_index, np.arange(n_lines), side='right') - 1
+
+    lengths = vertex_dist[last_vertex]
+    pieces = np.maximum(np.round(lengths / segment_length), 1).astype(np.int64)
+
+    # Distances of the split points: k / pieces of each line's length, k = 0..pieces
+    point_line = np.repeat(np.arange(n_lines), pieces + 1)
+    point_offset = np.arange(len(point_line)) - np.repeat(np.cumsum(pieces + 1) - (pieces + 1), pieces + 1)
+    target = lengths[point_line] * point_offset / pieces[point_line]
+
+    # Last vertex of the same line at or before each split point: sort vertices and split points
+    # together by (line, distance), vertices first on ties, and count the vertices passed
+    is_vertex = np.concatenate([np.ones(len(coords), dtype=bool), np.zeros(len(target), dtype=bool)])
+    order = np.lexsort((~is_vertex, np.concatenate([vertex_dist, target]), np.concatenate([line_index, point_line])))
+    vertices_passed = np.cumsum(is_vertex[order])
+    vertex = np.empty(len(target), dtype=np.int64)
+    vertex[order[~is_vertex[order]] - len(coords)] = vertices_passed[~is_vertex[order]] - 1
+
+    # Interpolate within the vertex pair of the same line the split point falls on
+    vertex = np.clip(vertex, first_vertex[point_line], np.maximum(last_vertex[point_line] - 1, first_vertex[point_line]))
+    next_vertex = np.minimum(vertex + 1, last_vertex[point_line])
+    span = vertex_dist[next_vertex] - vertex_dist[vertex]
+    ratio = np.divide(target - vertex_dist[vertex], span, out=np.zeros_like(span), where=span > 0)
+    points = coords[vertex] + ratio[:, np.newaxis] * (coords[next_vertex] - coords[vertex])
+
+    # Consecutive split points of the same line make the pieces
+    is_piece_start = np.ones(len(points), dtype=bool)
+    is_piece_start[np.cumsum(pieces + 1) - 1] = False
+    start = np.flatnonzero(is_piece_start)
+    line_coords = np.stack([points[start], points[start + 1]], axis=1)
+
+    result = gdf.iloc[np.repeat(np.arange(n_lines), pieces)].reset_index(drop=True)
+    result = result.set_geometry(shapely.linestrings(line_coords), crs=gdf.crs)
+    dx, dy = (line_coords[:, 1] - line_coords[:, 0]).T
+    result['length'] = np.hypot(dx, dy)
+    result['direction'] = segment_directions(dx, dy)
+    return result
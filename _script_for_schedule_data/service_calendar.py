@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from gtfs_feed import feed_files_key, read_feed_table
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+DATE_FORMAT = '%Y%m%d'  # GTFS dates, e.g. 20240320
+ADDED, REMOVED = 1, 2  # calendar_dates exception_type values
+
+# Parsed calendar tables by feed, so resolving many dates (or rerunning for another date) reads them once
+_calendar_cache = {}
+
+
+def _read_optional(folder_path, name, dtype):
+    """A calendar table, or None when the feed does not have it (both calendar files are optional)."""
+    try:
+        return read_feed_table(folder_path, name, dtype=dtype)
+    except FileNotFoundError:
+        return None
+
+
+def load_calendar(folder_path):
+    """calendar.txt and calendar_dates.txt of a feed (either may be None), cached per feed."""
+    key = feed_files_key(folder_path, ("calendar.txt", "calendar_dates.txt"))
+    if key not in _calendar_cache:
+        calendar = _read_optional(folder_path, "calendar.txt", {'service_id': str, 'start_date': str, 'end_date': str})
+        calendar_dates = _read_optional(folder_path, "calendar_dates.txt", {'service_id': str, 'date': str})
+        _calendar_cache[key] = (calendar, calendar_dates)
+    return _calendar_cache[key]
+
+
+def parse_dates(dates):
+    """GTFS date strings (or a single one) as a DatetimeIndex."""
+    if isinstance(dates, str):
+        dates = [dates]
+    return pd.DatetimeIndex(pd.to_datetime(pd.Series(dates, dtype=str).str.strip(), format=DATE_FORMAT))
+
+
+def service_days(calendar, calendar_dates, dates):
+    """
+    Which services run on which dates, as a boolean DataFrame of service_id rows and date columns
+    (YYYYMMDD). calendar gives the weekly pattern within its start and end dates, calendar_dates
+    adds (exception_type 1) or removes (2) single dates. All services and dates are evaluated at once.
+    """
+    dates = parse_dates(dates)
+    service_ids = []
+    if calendar is not None:
+        service_ids.append(calendar['service_id'])
+    if calendar_dates is not None:
+        service_ids.append(calendar_dates['service_id'])
+    services = pd.Index(pd.concat(service_ids).unique() if service_ids else [], dtype=object)
+    active = np.zeros((len(services), len(dates)), dtype=bool)
+
+    if calendar is not None and len(calendar):
+        days = dates.to_numpy()
+        start = pd.to_datetime(calendar['start_date'].str.strip(), format=DATE_FORMAT).to_numpy()
+        end = pd.to_datetime(calendar['end_date'].str.strip(), format=DATE_FORMAT).to_numpy()
+        weekly = calendar[WEEKDAYS].to_numpy(dtype=int) == 1
+        running = weekly[:, dates.weekday] & (start[:, None] <= days) & (end[:, None] >= days)
+        np.logical_or.at(active, services.get_indexer(calendar['service_id']), running)
+
+    if calendar_dates is not None and len(calendar_dates):
+        column = dates.get_indexer(parse_dates(calendar_dates['date']))
+        row = services.get_indexer(calendar_dates['service_id'])
+        exception = calendar_dates['exception_type'].to_numpy()
+        for exception_type, value in ((ADDED, True), (REMOVED, False)):
+            hit = (column >= 0) & (exception == exception_type)
+            active[row[hit], column[hit]] = value
+
+    return pd.DataFrame(active, index=services, columns=dates.strftime(DATE_FORMAT))
+
+
+def active_trips(trips, days, service_id_separator=None):
+    """
+    (trip_id, date) pairs of the trips running on each date of service_days, in trip order and
+    indexed by the trips' index labels, so trips.loc[pairs.index] selects the running trips.
+    With service_id_separator, the calendar service of a trip is the part of its service_id
+    after the last separator (Warszawa service_ids end with e.g. ':5_2' for calendar service '5_2').
+    """
+    service_ids = trips['service_id'].astype(str)
+    if service_id_separator:
+        service_ids = service_ids.str.rsplit(service_id_separator, n=1).str[-1]
+    running = days.reindex(service_ids.to_numpy(), fill_value=False).to_numpy()
+    trip_rows, date_columns = np.nonzero(running)
+    return pd.DataFrame({'trip_id': trips['trip_id'].iloc[trip_rows].array, 'date': days.columns[date_columns]},
+                        index=trips.index[trip_rows])
+
+
+def resolve_service(folder_path, trips, dates, service_id_separator=None):
+    """active_trips of a feed for one date or many (YYYYMMDD), from its cached calendar tables."""
+    calendar, calendar_dates = load_calendar(folder_path)
+    if calendar is None and calendar_dates is None:
+        raise FileNotFoundError(f"Neither calendar.txt nor calendar_dates.txt found in {folder_path}")
+    return active_trips(trips, service_days(calendar, calendar_dates, dates), service_id_separator)
+
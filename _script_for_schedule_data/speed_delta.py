@@ -0,0 +1,129 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from city_profiles import city_profile, CITY_PROFILES
+from gtfs_feed import share_categories
+from layer_io import OUTPUT_FORMATS
+from observed_speeds import stage_01_observed, load_observed_processed
+from pipeline import load_shapes_processed, save_corridors, save_segments, stage_02_segments, stage_03_corridors
+from speeds import RUNNING_SPEED, SCHEDULED_SPEED, SPEED_RATIO, DELAY, CUM_DELAY
+
+DELTA_KEYS = ['shape_id', 'shape_pt_sequence']  # Shape point both speeds are compared at (and band, if split)
+DELTA_PROCESSED = "delta_processed.csv"  # Like shapes_processed.csv, with both speeds of every shape point
+
+
+def delta_keys(df):
+    """DELTA_KEYS, and 'band' when speeds are split into time bands."""
+    return DELTA_KEYS + (['band'] if 'band' in df else [])
+
+
+def join_speeds(scheduled, observed):
+    """
+    Shape points having both a scheduled (shapes_processed) and an observed speed (see
+    observed_speeds), joined in one merge on their shape point (see delta_keys): both come from
+    the same shapes.txt, so no point is matched again in space. The scheduled points keep their
+    coordinates, distance and vehicle and get the observed 'speed', the scheduled one as
+    SCHEDULED_SPEED and SPEED_RATIO, observed over scheduled.
+    """
+    if ('band' in scheduled) != ('band' in observed):
+        raise ValueError("Scheduled and observed speeds must both be split into speed bands, or neither")
+    keys = delta_keys(scheduled)
+    scheduled = scheduled.drop(columns=[RUNNING_SPEED], errors='ignore').rename(columns={'speed': SCHEDULED_SPEED})
+    observed = observed[keys + ['speed']].copy()
+
+    # Labels as categoricals with the same categories on both sides, so the merge compares codes
+    labels = [key for key in keys if key != 'shape_pt_sequence']
+    for df in (scheduled, observed):
+        df['shape_pt_sequence'] = df['shape_pt_sequence'].astype(np.int64)
+        for key in labels:
+            df[key] = df[key].astype(str).astype('category')
+    for key in labels:
+        share_categories([scheduled, observed], key)
+
+    joined = pd.merge(scheduled, observed, on=keys, how='inner')
+    joined[SPEED_RATIO] = joined['speed'] / joined[SCHEDULED_SPEED]
+    print(f"{len(joined)} of {len(scheduled)} scheduled shape points have an observed speed")
+    return joined
+
+
+def add_delays(segments):
+    """
+    DELAY of stage 02 segments of joined speeds, the seconds a segment takes at the observed speed
+    minus at the scheduled one (from its length), and CUM_DELAY, their running sum along every
+    shape (and band), in the order of the segments.
+    """
+    hours_per_km = 1 / segments['speed'].to_numpy(dtype=float) - 1 / segments[SCHEDULED_SPEED].to_numpy(dtype=float)
+    segments[DELAY] = segments['length'].to_numpy() * 3.6 * hours_per_km
+    keys = ['shape_id'] + (['band'] if 'band' in segments else [])
+    segments[CUM_DELAY] = segments.groupby(keys, observed=True, sort=False)[DELAY].cumsum()
+    return segments
+
+
+def stage_02_delta(delta_processed, profile):
+    """Stage 02 of joined speeds: the speed segments, both speeds and their ratio taken from the end point, with delays."""
+    return add_delays(stage_02_segments(delta_processed, profile, 'speeds'))
+
+
+def save_delta_processed(delta_processed, profile):
+    delta_processed.to_csv(os.path.join(profile['folder_path'], DELTA_PROCESSED), index=False)
+
+
+def run_delta(city, store_dir=None, dates=None, save_intermediate=False, workers=None, **overrides):
+    """
+    Compares the observed speeds of a city with its scheduled ones (shapes_processed.csv, see
+    pipeline.run_city with save_intermediate) and runs stages 02 and 03 on the comparison.
+    Observed speeds are matched from the positions store, or read from observed_processed.csv
+    without one. Returns the timings, like pipeline.run_city.
+    """
+    profile = city_profile(city, **overrides)
+    summary = {'city': city, 'kind': 'delta'}
+
+    started = time.perf_counter()
+    observed = stage_01_observed(profile, store_dir, dates) if store_dir else load_observed_processed(profile)
+    delta_processed = join_speeds(load_shapes_processed(profile), observed)
+    summary['stage_01_s'], summary['stage_01_rows'] = time.perf_counter() - started, len(delta_processed)
+
+    started = time.perf_counter()
+    segments = stage_02_delta(delta_processed, profile)
+    summary['stage_02_s'], summary['stage_02_rows'] = time.perf_counter() - started, len(segments)
+
+    started = time.perf_counter()
+    corridors = stage_03_corridors(segments, 'speeds', workers)
+    summary['stage_03_s'] = time.perf_counter() - started
+    summary['stage_03_rows'] = sum(len(gdf) for gdf in corridors.values())
+
+    if save_intermediate:
+        save_delta_processed(delta_processed, profile)
+        save_segments(segments, profile, 'delta')
+    save_corridors(corridors, profile, 'delta')
+
+    print(f"{city} delta: " + ", ".join(
+        f"stage {stage} {summary[f'stage_{stage}_rows']} rows in {summary[f'stage_{stage}_s']:.1f} s"
+        for stage in ('01', '02', '03')))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compares a city's observed speeds with its scheduled ones and runs stages 02-03 on the comparison.")
+    parser.add_argument('city', choices=sorted(CITY_PROFILES))
+    parser.add_argument('--store', help="Positions store to match observed speeds from; observed_processed.csv by default")
+    parser.add_argument('--date', action='append', help="Date partition (YYYY-MM-DD) of the store to match, repeatable; all by default")
+    parser.add_argument('--folder', help="Feed folder, instead of the profile's folder_path")
+    parser.add_argument('--save-intermediate', action='store_true', help="Also write delta_processed.csv and the segments layer")
+    parser.add_argument('--workers', type=int, help="Processes for the stage 03 corridor aggregation")
+    parser.add_argument('--output-format', choices=sorted(OUTPUT_FORMATS),
+                        help="Format of the segment and corridor layers, instead of the profile's output_format")
+    args = parser.parse_args()
+
+    overrides = {'folder_path': args.folder} if args.folder else {}
+    if args.output_format:
+        overrides['output_format'] = args.output_format
+    run_delta(args.city, args.store, args.date, args.save_intermediate, args.workers, **overrides)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+
+MAX_SPEED = 80  # Maximum allowable speed in km/h
+MIN_SPEED = 1  # Speeds below this (km/h) are treated as invalid
+SPEED_KEYS = ['shape_id', 'shape_dist_traveled', 'vehicle']  # Where speeds are averaged
+RUNNING_SPEED = 'run_spd'  # Running speed column (departure to next arrival), short for shapefile fields
+SPEED_LAYERS = ['speed', RUNNING_SPEED]  # Speed columns averaged when present; 'speed' is the commercial speed
+# Comparison of observed with scheduled speeds (see speed_delta.py), also short for shapefile fields
+SCHEDULED_SPEED = 'sched_spd'  # Scheduled speed next to the observed 'speed'
+SPEED_RATIO = 'spd_ratio'  # Observed over scheduled speed, below 1 where vehicles run slower than timetabled
+DELAY = 'delay'  # Seconds a segment takes longer than timetabled (negative when faster)
+CUM_DELAY = 'cum_delay'  # delay accumulated along the shape up to the end of the segment
+DELTA_LAYERS = [SCHEDULED_SPEED, SPEED_RATIO, DELAY, CUM_DELAY]
+
+
+def assign_nearest_speeds(shapes, average_speed_shape, direction='nearest'):
+    """
+    Gives every shape point the average speed (and the other speed layers of average_speed_shape)
+    measured at the nearest shape_dist_traveled of its shape.
+    Points without shape_dist_traveled are placed by their sequence ratio along the shape's measured length.
+    Shapes without any speed measurement are dropped. Rows come out ordered by shape_id and shape_pt_sequence.
+    This is one grouped merge_asof instead of a nearest-distance search per point.
+    direction='forward' takes the next measurement along the shape instead, i.e. the speed of the stretch
+    leading to the next stop, like the bfill of the exact-distance merge when distances do not match exactly.
+    """
+    # On equal distances (several vehicles) the first measurement wins, as with idxmin
+    speeds = average_speed_shape.drop_duplicates(subset=['shape_id', 'shape_dist_traveled'])
+    speeds = speeds.drop(columns=['vehicle'], errors='ignore').rename(columns={'shape_dist_traveled': '_lookup_dist'})
+
+    shapes = shapes[shapes['shape_id'].isin(speeds['shape_id'])]
+    shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence'])
+    shapes = shapes.assign(_order=range(len(shapes)))
+
+    # Estimate the position of points without a distance from their sequence number
+    max_sequence = shapes.groupby('shape_id', observed=True)['shape_pt_sequence'].transform('max')
+    # Mapping categorical shape_ids gives a categorical, cast back to numbers
+    max_dist = shapes['shape_id'].map(speeds.groupby('shape_id', observed=True)['_lookup_dist'].max()).astype(float)
+    estimated_dist = shapes['shape_pt_sequence'] / max_sequence * max_dist
+    shapes['_lookup_dist'] = shapes['shape_dist_traveled'].fillna(estimated_dist).astype(float)
+
+    # Ties between two measurements go to the lower distance, as with idxmin
+    shapes = pd.merge_asof(
+        shapes.sort_values('_lookup_dist'),
+        speeds.sort_values('_lookup_dist').astype({'_lookup_dist': float}),
+        on='_lookup_dist', by='shape_id', direction=direction
+    )
+
+    return shapes.sort_values('_order').drop(columns=['_order', '_lookup_dist']).reset_index(drop=True)
+
+
+def trip_codes(trip_ids):
+    """Integer code of every row's trip_id, ordered like the ids (the codes of a categorical)."""
+    if isinstance(trip_ids.dtype, pd.CategoricalDtype):
+        return trip_ids.cat.codes.to_numpy()
+    return pd.factorize(trip_ids, sort=True)[0]
+
+
+def trip_order(codes, arrival):
+    """
+    Positions sorting rows by trip code, then arrival (seconds, not negative), ties kept in input
+    order. Both are packed into one int64 key, which sorts faster than two; rows already in
+    order (feeds listing trips one after another) are not sorted at all.
+    """
+    key = (codes.astype(np.int64) << 32) | arrival.astype(np.int64)
+    if (key[1:] >= key[:-1]).all():
+        return np.arange(len(key))
+    return np.argsort(key, kind='stable')
+
+
+def valid_speeds(speed, max_speed=MAX_SPEED):
+    """Speeds within MIN_SPEED and max_speed (False for NaN, e.g. missing distances or no time)."""
+    return (speed >= MIN_SPEED) & (speed <= max_speed)
+
+
+def speed_kernel(trips, arrival, dist, max_speed=MAX_SPEED, departure=None):
+    """
+    Speeds between consecutive stops of trip-sorted arrays, in one pass over them:
+    trips are trip codes, arrival (and departure) seconds and dist kilometers, with every trip's
+    rows together and in order. A row forms a stretch with the row before it when both belong to
+    the same trip (rows without a trip, code -1, form none).
+    Returns the positions of the rows ending a valid stretch (time > 0, commercial speed within
+    MIN_SPEED and max_speed, known distances) and their time_diff, dist_diff and speed (km/h,
+    arrival to arrival, so including the dwell at the previous stop). With departure, the
+    running speed (previous departure to arrival) of those stretches is returned too, NaN where
+    it is not valid itself; otherwise None.
+    """
+    same_trip = (trips[1:] == trips[:-1]) & (trips[1:] >= 0)
+    time_diff = np.diff(arrival.astype(np.int64)).astype(np.float64)
+    dist_diff = np.diff(dist).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed = dist_diff / time_diff * 3600  # Convert speed to km/h
+
+    valid = same_trip & (time_diff > 0) & valid_speeds(speed, max_speed)
+    rows = np.flatnonzero(valid)
+    running = None
+    if departure is not None:
+        running_time = (arrival[1:][rows].astype(np.int64) - departure[:-1][rows]).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            running = dist_diff[rows] / running_time * 3600
+        running[~((running_time > 0) & valid_speeds(running, max_speed))] = np.nan
+    return rows + 1, time_diff[valid], dist_diff[valid], speed[valid], running
+
+
+def calculate_speeds(stop_times, max_speed=MAX_SPEED, running=False):
+    """
+    Speed (km/h) of every stretch between consecutive stops of a trip, from arrival_time (seconds)
+    and shape_dist_traveled (kilometers), as the rows ending the stretches with prev_departure_time
+    (when the stretch starts), time_diff, dist_diff and speed columns. The first stop of a trip has
+    no stretch to it. Stretches with no time, or a speed below MIN_SPEED or above max_speed, are
+    dropped. Rows come out ordered by trip_id and arrival_time.
+    running adds the RUNNING_SPEED column, measured from departure_time of the previous stop, so
+    without the dwell time (see speed_kernel).
+    """
+    arrival = stop_times['arrival_time'].to_numpy()
+    codes = trip_codes(stop_times['trip_id'])
+    order = trip_order(codes, arrival)
+    departure = stop_times['departure_time'].to_numpy()[order]
+
+    rows, time_diff, dist_diff, speed, running_speed = speed_kernel(
+        codes[order], arrival[order], stop_times['shape_dist_traveled'].to_numpy()[order], max_speed,
+        departure if running else None)
+    stop_times = stop_times.iloc[order[rows]].assign(prev_departure_time=departure[rows - 1], time_diff=time_diff,
+                                                     dist_diff=dist_diff, speed=speed)
+    if running:
+        stop_times[RUNNING_SPEED] = running_speed
+    return stop_times
+
+
+def dwell_sums(stop_times):
+    """
+    Sum, number and maximum of the dwell times (departure_time - arrival_time, seconds) at every stop_id.
+    Like speed_sums, the sums of separate batches add up (see add_dwell_sums).
+    """
+    dwell = (stop_times['departure_time'].astype(np.int64) - stop_times['arrival_time']).rename('dwell')
+    grouped = dwell[dwell >= 0].groupby(stop_times['stop_id'], observed=True)
+    return pd.DataFrame({'dwell_sum': grouped.sum(), 'dwell_count': grouped.count(), 'dwell_max': grouped.max()}).reset_index()
+
+
+def add_dwell_sums(sums):
+    """Adds up the dwell_sums of several batches."""
+    grouped = pd.concat(sums, ignore_index=True).groupby('stop_id', observed=True)
+    return grouped.agg(dwell_sum=('dwell_sum', 'sum'), dwell_count=('dwell_count', 'sum'),
+                       dwell_max=('dwell_max', 'max')).reset_index()
+
+
+def dwell_stats(sums):
+    """Dwell time statistics of every stop (seconds) from its dwell_sums: number of stop_times, mean and maximum."""
+    return sums.assign(dwell_mean=sums['dwell_sum'] / sums['dwell_count'])[
+        ['stop_id', 'dwell_count', 'dwell_mean', 'dwell_max']]
+
+
+def speed_keys(df):
+    """SPEED_KEYS, and 'band' when speeds are split into time bands (see gtfs_time.assign_bands)."""
+    return SPEED_KEYS + (['band'] if 'band' in df else [])
+
+
+def speed_sums(stop_times, trips):
+    """
+    Sum and number of the speeds (every layer of SPEED_LAYERS in stop_times, as '{layer}_sum'
+    and '{layer}_count') measured at every shape_id, shape_dist_traveled and vehicle, and band
+    if stop_times have one. trips must carry a 'vehicle' column, stop_times a 'speed' column
+    (see calculate_speeds). With a 'weight' column every speed counts that many times (the virtual
+    trips of frequency-based trips, see frequencies.weigh_virtual_trips). The sums of separate
+    batches of trips add up (see add_speed_sums), so averages do not need all stop_times in memory at once.
+    """
+    layers = [layer for layer in SPEED_LAYERS if layer in stop_times]
+    keys = speed_keys(stop_times)
+    weighted = 'weight' in stop_times
+    # shape_id and vehicle come from trips
+    stop_times = stop_times[['trip_id', 'shape_dist_traveled'] + keys[len(SPEED_KEYS):] + layers + (['weight'] if weighted else [])]
+    stop_times = pd.merge(stop_times, trips[['trip_id', 'shape_id', 'vehicle']], on='trip_id', how='inner')
+    if weighted:
+        for layer in layers:
+            weight = stop_times['weight'].where(stop_times[layer].notna(), 0)
+            stop_times[f'{layer}_sum'], stop_times[f'{layer}_count'] = stop_times[layer] * weight, weight
+        return stop_times.groupby(keys, observed=True)[
+            [f'{layer}_{total}' for layer in layers for total in ('sum', 'count')]].sum().reset_index()
+    grouped = stop_times.groupby(keys, observed=True)
+    columns = {}
+    for layer in layers:
+        columns[f'{layer}_sum'] = grouped[layer].sum()
+        columns[f'{layer}_count'] = grouped[layer].count()
+    return pd.DataFrame(columns).reset_index()
+
+
+def add_speed_sums(sums):
+    """Adds up the speed_sums of several batches of trips."""
+    sums = pd.concat(sums, ignore_index=True)
+    return sums.groupby(speed_keys(sums), observed=True).sum().reset_index()
+
+
+def average_speeds(sums):
+    """The speed layers of speed_sums as averages, NaN where a layer has no measurement."""
+    layers = [layer for layer in SPEED_LAYERS if f'{layer}_sum' in sums]
+    return pd.DataFrame({layer: sums[f'{layer}_sum'] / sums[f'{layer}_count'].where(sums[f'{layer}_count'] > 0)
+                         for layer in layers})
+
+
+def speed_cube(sums):
+    """The average speeds of band-split speed_sums, one row per shape_id, distance, vehicle and band, with n measurements."""
+    return sums[speed_keys(sums)].join(average_speeds(sums)).assign(n=sums['speed_count'])
+
+
+def shape_speeds(shapes, trips, stop_times, matching='nearest'):
+    """
+    Gives the shape points the average speed of the trips following them, and their vehicle.
+    trips must carry a 'vehicle' column, stop_times a 'speed' column (see calculate_speeds).
+    matching is how a point picks its measurement along the shape: 'nearest', 'forward' (next
+    measurement, see assign_nearest_speeds) or 'bfill' (exact shape_dist_traveled match, backfilled).
+    Points left without a valid speed are dropped.
+    """
+    return shape_speeds_from_sums(shapes, speed_sums(stop_times, trips), matching)
+
+
+def shape_speeds_from_sums(shapes, sums, matching='nearest'):
+    """shape_speeds from the speed_sums of all trips; every speed layer of the sums is matched the same way."""
+    # Average speeds for each shape_id, shape_dist_traveled and vehicle
+    average_speed_shape = sums[SPEED_KEYS].join(average_speeds(sums))
+
+    # Shapes take the vehicle type of their trips
+    vehicle_mapping = sums[['shape_id', 'vehicle']].drop_duplicates()
+    shapes = pd.merge(shapes, vehicle_mapping, on='shape_id', how='left')
+
+    if matching == 'bfill':
+        # Average over all vehicles at each distance
+        by_point = sums.drop(columns=['vehicle']).groupby(['shape_id', 'shape_dist_traveled'], observed=True).sum()
+        average_speed_shape = average_speeds(by_point).reset_index()
+        layers = list(average_speed_shape.columns[2:])
+        shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence'])
+        shapes = pd.merge(shapes, average_speed_shape, on=['shape_id', 'shape_dist_traveled'], how='left')
+        shapes[layers] = shapes.groupby('shape_id', observed=True)[layers].bfill()
+    else:
+        shapes = assign_nearest_speeds(shapes, average_speed_shape, direction=matching)
+
+    # Filter out invalid speeds
+    shapes = shapes.dropna(subset=['speed'])
+    return shapes[shapes['speed'] >= MIN_SPEED].reset_index(drop=True)
+
+
+def band_shape_speeds(shapes, sums, matching='nearest'):
+    """
+    shape_speeds_from_sums for every band of band-split speed_sums, the shape points of all
+    bands stacked with a 'band' column, bands in their order. Every band is matched on its own,
+    from the same sums, so no band needs the speeds computed again.
+    """
+    parts = [shape_speeds_from_sums(shapes, band_sums.drop(columns=['band']), matching).assign(band=band)
+             for band, band_sums in sums.groupby('band', observed=True)]
+    if not parts:
+        return shape_speeds_from_sums(shapes, sums.drop(columns=['band']), matching).assign(band=pd.Series(dtype=str))
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+
+import pyarrow.feather as feather
+
+from gtfs_feed import feed_source
+
+CACHE_NAME = "stop_times_processed.arrow"
+CACHE_VERSION = 2  # 2: ids stored dictionary-encoded, distances as float32
+
+
+def file_fingerprint(path, with_hash=True):
+    """Size, mtime and (optionally) sha1 of a source file, used to tell if a cache is stale."""
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        fingerprint['sha1'] = sha1.hexdigest()
+    return fingerprint
+
+
+def _read_meta(meta_path):
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def _write_meta(meta_path, meta):
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def is_cache_valid(cache_path, source_path, key=None):
+    """
+    Checks the cache sidecar against the source file.
+    The cheap size/mtime check is tried first. If only the mtime changed (e.g. the feed was
+    extracted again) the file hash decides, and the stored mtime is refreshed when it matches.
+    """
+    meta_path = cache_path + ".json"
+    meta = _read_meta(meta_path)
+    if meta is None or not os.path.exists(cache_path):
+        return False
+    if meta.get('version') != CACHE_VERSION or meta.get('key') != key:
+        return False
+
+    current = file_fingerprint(source_path, with_hash=False)
+    source = meta['source']
+    if current['size'] != source['size']:
+        return False
+    if current['mtime_ns'] == source['mtime_ns']:
+        return True
+
+    current = file_fingerprint(source_path)
+    if current['sha1'] != source.get('sha1'):
+        return False
+
+    meta['source'] = current
+    _write_meta(meta_path, meta)
+    return True
+
+
+def write_cache(df, cache_path, source_path, key=None):
+    """Saves df as an uncompressed Arrow IPC file so it can be memory-mapped on load."""
+    tmp_path = cache_path + ".tmp"
+    feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, cache_path)
+    _write_meta(cache_path + ".json", {
+        'version': CACHE_VERSION,
+        'key': key,
+        'source': file_fingerprint(source_path),
+        'columns': list(df.columns),
+    })
+
+
+def read_cache(cache_path, columns=None):
+    """Reads only the requested columns, memory-mapping the file instead of loading it whole."""
+    table = feather.read_table(cache_path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def load_cached_stop_times(folder_path, build, columns=None, key=None, cache_name=CACHE_NAME):
+    """
+    Returns parsed stop_times, from the columnar cache in folder_path if it is still valid.
+    build() is called to produce the full parsed DataFrame when the cache is missing or stale.
+    key describes how build() parses the feed (e.g. the time mode); a different key rebuilds the cache.
+    The cache follows whichever file stop_times are read from: stop_times.txt or the feed zip.
+    """
+    source_path = feed_source(folder_path, "stop_times.txt")
+    cache_path = os.path.join(folder_path, cache_name)
+
+    if is_cache_valid(cache_path, source_path, key):
+        print(f"Loading stop_times from cache {cache_name}")
+        return read_cache(cache_path, columns)
+
+    print(f"Building stop_times cache {cache_name}")
+    stop_times = build()
+    write_cache(stop_times, cache_path, source_path, key)
+    if columns is not None:
+        stop_times = stop_times[columns]
+    return stop_times
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from gtfs_feed import concat_chunks
+
+SPILL_PARTITIONS = 16  # Partitions stop_times are spilled into; only one of them is loaded at a time
+SPILL_PREFIX = "stop_times_spill_"  # Prefix of the temporary spill folders
+
+
+def trip_partitions(trip_ids, partitions):
+    """Partition number of every row from the hash of its trip_id, so all stop_times of a trip land together."""
+    hashes = pd.util.hash_pandas_object(pd.Series(trip_ids, copy=False).astype(str), index=False).to_numpy()
+    return (hashes % np.uint64(partitions)).astype(np.int64)
+
+
+def _partition_files(spill_dir, partition):
+    prefix = f"{partition:03d}_"
+    return sorted(os.path.join(spill_dir, name) for name in os.listdir(spill_dir) if name.startswith(prefix))
+
+
+def spill_partitions(chunks, spill_dir, partitions=SPILL_PARTITIONS):
+    """
+    Writes every chunk of stop_times, split by trip_partitions, to feather files in spill_dir
+    (one file per chunk and partition, numbered so a partition reads back in file order).
+    Returns the number of rows of every partition.
+    """
+    rows = np.zeros(partitions, dtype=np.int64)
+    for number, chunk in enumerate(chunks):
+        keys = trip_partitions(chunk['trip_id'], partitions)
+        for partition, part in chunk.groupby(keys, sort=False):
+            feather.write_feather(part.reset_index(drop=True), os.path.join(spill_dir, f"{partition:03d}_{number:05d}.arrow"))
+            rows[partition] += len(part)
+    return rows
+
+
+def read_partition(spill_dir, partition):
+    """The stop_times of one partition, in the order they were read; None when it is empty."""
+    files = _partition_files(spill_dir, partition)
+    if not files:
+        return None
+    return concat_chunks([feather.read_feather(path) for path in files])
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# The pipeline modules are scripts imported by name from their folder, like pipeline.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STOPS_PER_SHAPE = 4  # Points of the shorter shape, every shape point is a stop 1 km from the previous one
+
+
+def write_feed(folder_path, slow_shapes=()):
+    """
+    A feed of two shapes of different lengths (so their lengths map one to one), one trip each at
+    07:00 taking 2 minutes per stop, 4 on slow_shapes.
+    """
+    shapes, stop_times, stops, trips = [], [], [], []
+    for shape, points in (('s1', STOPS_PER_SHAPE), ('s2', STOPS_PER_SHAPE + 1)):
+        trip = f'{shape}_t'
+        trips.append(('r1', 'x', trip, shape))
+        for point in range(points):
+            lat = 52.2 + 0.009 * point
+            lon = 21.0 if shape == 's1' else 21.01
+            shapes.append((shape, lat, lon, point + 1, float(point)))
+            stops.append((f'{shape}_{point}', lat, lon))
+            time = f'07:{point * (4 if shape in slow_shapes else 2):02d}:00'
+            stop_times.append((trip, time, time, f'{shape}_{point}', point + 1, float(point)))
+    pd.DataFrame(shapes, columns=['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence',
+                                  'shape_dist_traveled']).to_csv(folder_path / 'shapes.txt', index=False)
+    pd.DataFrame(stop_times, columns=['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence',
+                                      'shape_dist_traveled']).to_csv(folder_path / 'stop_times.txt', index=False)
+    pd.DataFrame(stops, columns=['stop_id', 'stop_lat', 'stop_lon']).to_csv(folder_path / 'stops.txt', index=False)
+    pd.DataFrame(trips, columns=['route_id', 'service_id', 'trip_id', 'shape_id']).to_csv(folder_path / 'trips.txt', index=False)
+
+
+@pytest.fixture
+def feed_folder(tmp_path):
+    """Folder of the feed of write_feed, as a string like the profiles' folder_path."""
+    write_feed(tmp_path)
+    return str(tmp_path)
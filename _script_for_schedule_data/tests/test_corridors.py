@@ -0,0 +1,43 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from corridors import direction_difference, longest_first, parallel_pairs, BUFFER_DISTANCE, MAX_DIRECTION_DIFF
+
+SEGMENTS = 3000  # Random segments compared
+EXTENT = 500  # Side (in meters) of the square the segments are scattered in
+
+
+def random_segments(n=SEGMENTS, seed=5, extent=EXTENT):
+    """n random 5-15 m segments in a metric CRS, with their length and direction, longest first."""
+    rng = np.random.default_rng(seed)
+    start = rng.uniform(0, extent, (n, 2))
+    angle = rng.uniform(0, 2 * np.pi, n)
+    end = start + rng.uniform(5, 15, n)[:, np.newaxis] * np.column_stack([np.cos(angle), np.sin(angle)])
+    gdf = gpd.GeoDataFrame({'length': np.hypot(*(end - start).T), 'direction': np.degrees(angle) % 360},
+                           geometry=shapely.linestrings(np.stack([start, end], axis=1)), crs="EPSG:2180")
+    return gdf.iloc[longest_first(gdf['length'])].reset_index(drop=True)
+
+
+def loop_pairs(gdf, distance=BUFFER_DISTANCE, max_direction_diff=MAX_DIRECTION_DIFF):
+    """Neighbour pairs as the old 03 counts script found them, one sindex.intersection(buffer.bounds) per segment."""
+    i, j = [], []
+    for idx, geometry in enumerate(gdf.geometry):
+        for match in gdf.sindex.intersection(geometry.buffer(distance).bounds):
+            difference = direction_difference(gdf['direction'].iloc[idx], gdf['direction'].iloc[match])
+            if match != idx and difference <= max_direction_diff:
+                i.append(idx)
+                j.append(match)
+    order = np.lexsort((j, i))
+    return np.array(i)[order], np.array(j)[order]
+
+
+def test_parallel_pairs_bounding_boxes_match_the_old_loop():
+    gdf = random_segments()
+
+    bulk_i, bulk_j = parallel_pairs(gdf, directions=gdf['direction'], bounding_boxes=True)
+    loop_i, loop_j = loop_pairs(gdf)
+
+    assert len(bulk_i) > 0
+    assert np.array_equal(bulk_i, loop_i)
+    assert np.array_equal(bulk_j, loop_j)
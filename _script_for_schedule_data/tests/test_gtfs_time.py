@@ -0,0 +1,20 @@
+import numpy as np
+
+from gtfs_time import band_labels, window_edges, window_labels
+
+LATE_BANDS = [('night', '00:00:00', '06:00:00'), ('evening', '18:00:00', '00:00:00')]
+
+
+def test_band_running_to_midnight_does_not_overlap_the_next_one():
+    seconds = [18 * 3600, 24 * 3600 - 1, 0, 6 * 3600 - 1, 6 * 3600]
+
+    assert band_labels(seconds, LATE_BANDS).tolist() == [1, 1, 0, 0, -1]
+
+
+def test_window_ending_at_midnight_runs_to_the_end_of_the_day():
+    starts, ends, labels = window_edges([('22:00:00', '00:00:00'), ('00:00:01', '05:00:00')])
+
+    assert starts.tolist() == [1, 22 * 3600]
+    assert ends.tolist() == [5 * 3600, 24 * 3600]
+    assert labels.tolist() == [1, 0]
+    assert window_labels(np.array([22 * 3600, 24 * 3600 - 1, 0, 1]), [('22:00:00', '00:00:00')]).tolist() == [0, 0, -1, -1]
@@ -0,0 +1,32 @@
+import os
+
+import geopandas as gpd
+
+import incremental
+from conftest import write_feed
+from incremental import run_incremental, state_dir
+
+
+def test_run_incremental_rebuilds_segments_of_changed_shapes_only(tmp_path, monkeypatch):
+    previous_folder, folder = tmp_path / 'a', tmp_path / 'b'
+    for path, slow_shapes in ((previous_folder, ()), (folder, ('s2',))):
+        path.mkdir()
+        write_feed(path, slow_shapes)
+
+    run_incremental('Warszawa', 'speeds', folder_path=str(previous_folder), service=None)
+    stage_02_segments, rebuilt = incremental.stage_02_segments, []
+
+    def recording_stage_02(shapes_processed, profile, kind):
+        rebuilt.extend(shapes_processed['shape_id'].astype(str).unique())
+        return stage_02_segments(shapes_processed, profile, kind)
+
+    monkeypatch.setattr(incremental, 'stage_02_segments', recording_stage_02)
+    summary = run_incremental('Warszawa', 'speeds', str(previous_folder), folder_path=str(folder), service=None)
+
+    assert summary['changed_shapes'] == 1
+    assert rebuilt == ['s2']
+    previous_segments, segments = (gpd.read_feather(os.path.join(state_dir(str(path), 'speeds'), "segments.arrow"))
+                                   for path in (previous_folder, folder))
+    unchanged = previous_segments[previous_segments['shape_id'] == 's1'].reset_index(drop=True)
+    assert segments[segments['shape_id'] == 's1'].reset_index(drop=True)['length'].equals(unchanged['length'])
+    assert segments.loc[segments['shape_id'] == 's2', 'speed'].round(6).eq(15).all()
@@ -0,0 +1,17 @@
+import pandas as pd
+import pytest
+
+from city_profiles import city_profile
+from pipeline import stage_01_speeds
+
+
+@pytest.mark.parametrize('speed_matching', ['nearest', 'forward'])
+def test_stage_01_speeds_matches_categorical_shape_ids(feed_folder, speed_matching):
+    profile = city_profile('Warszawa', folder_path=feed_folder, service=None, speed_matching=speed_matching)
+
+    shapes_processed = stage_01_speeds(profile)[0]
+
+    assert isinstance(shapes_processed['shape_id'].dtype, pd.CategoricalDtype)
+    assert shapes_processed.groupby('shape_id', observed=True).size().tolist() == [4, 5]
+    # 1 km every 2 minutes at every shape point
+    assert shapes_processed['speed'].round(6).eq(30).all()
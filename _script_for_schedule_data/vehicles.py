@@ -0,0 +1,66 @@
+import re
+
+# GTFS route_type codes (basic and extended) of the vehicle types on the maps
+ROUTE_TYPE_VEHICLES = {0: 'Tram', 1: 'Metro', 2: 'Train', 3: 'Bus', 11: 'Trolleybus', 12: 'Train'}
+EXTENDED_ROUTE_TYPE_VEHICLES = {1: 'Train', 4: 'Metro', 7: 'Bus', 8: 'Trolleybus', 9: 'Tram'}  # by hundreds
+
+
+def vehicle_from_route_id(route_id):
+    """
+    Determines vehicle type based on route_id pattern (Warszawa):
+    - 1-2 digits: Tram
+    - 3 digits: Bus
+    - Starts with S or R: Train
+    """
+    route_id = str(route_id).strip()
+
+    if route_id.isdigit():
+        if len(route_id) <= 2:
+            return 'Tram'
+        elif len(route_id) == 3:
+            return 'Bus'
+    elif route_id.startswith(('S', 'R')):
+        return 'Train'
+    return 'Bus'  # Default to Bus for other cases like 'E-1'
+
+
+def vehicle_from_shape_id(shape_id):
+    """Determines vehicle type from the line number opening the shape_id (Gdansk): 1-2 digits Tram, 3 digits Bus."""
+    if re.search(r'^\d{1,2}_', shape_id):
+        return 'Tram'
+    elif re.search(r'^\d{3}_', shape_id):
+        return 'Bus'
+    else:
+        return 'Unknown'
+
+
+def vehicle_from_route_type(route_type):
+    """Determines vehicle type from the GTFS route_type of routes.txt, basic or extended."""
+    route_type = int(route_type)
+    if route_type in ROUTE_TYPE_VEHICLES:
+        return ROUTE_TYPE_VEHICLES[route_type]
+    return EXTENDED_ROUTE_TYPE_VEHICLES.get(route_type // 100, 'Unknown')
+
+
+def _map_unique(values, function):
+    """Applies function once per distinct value instead of once per row."""
+    unique = values.dropna().unique()
+    return values.map(dict(zip(unique, map(function, unique))))
+
+
+def assign_vehicles(trips, vehicle_type, routes=None):
+    """
+    Adds the 'vehicle' column to trips according to the city profile's vehicle_type:
+    'route_id', 'shape_id', 'route_type' (needs routes) or a fixed vehicle name such as 'Bus'.
+    """
+    trips = trips.copy()
+    if vehicle_type == 'route_id':
+        trips['vehicle'] = _map_unique(trips['route_id'], vehicle_from_route_id)
+    elif vehicle_type == 'shape_id':
+        trips['vehicle'] = _map_unique(trips['shape_id'], vehicle_from_shape_id)
+    elif vehicle_type == 'route_type':
+        route_vehicles = routes.set_index('route_id')['route_type'].map(vehicle_from_route_type)
+        trips['vehicle'] = trips['route_id'].map(route_vehicles).fillna('Unknown')
+    else:
+        trips['vehicle'] = vehicle_type
+    return trips